@@ -0,0 +1,249 @@
+"""Offline load test: main.py under gunicorn against bench/fake_upstream.py.
+
+    python bench/carico.py                                   # all scenarios, 8 clients, 200 requests each
+    python bench/carico.py -c 32 -n 1000 --scenari legge,html_federale
+    python bench/carico.py --latenza openai=1500:500 --errori openai=0.05 --workers 4
+    python bench/carico.py --json risultati.json             # also write the numbers for comparisons
+
+Starts the fake upstreams in-process and main.py under gunicorn (with
+gunicorn.conf.py, a throwaway CACHE_DIR and rate limiting disabled), then
+fires each scenario at fixed concurrency. --chiavi sets how many distinct
+decisions/queries/laws a scenario cycles through: the first pass over them is
+cold, the rest is served from the caches. Reports p50/p95/p99 latency,
+requests/s and non-2xx responses per scenario, then the mean duration of each
+processing stage from /metrics. The environment is passed through, so
+LLM_RPM/LLM_TPM still apply: raise them to measure the app rather than the
+admission budget.
+
+The tokenizer tables are not faked: run once online, or set TIKTOKEN_CACHE_DIR
+to a directory that already holds them.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+
+QUI = os.path.dirname(os.path.abspath(__file__))
+RADICE = os.path.dirname(QUI)
+sys.path.insert(0, QUI)
+
+import fake_upstream  # noqa: E402
+
+TEMI = [
+    "licenziamento immediato giusti motivi",
+    "responsabilità del detentore di animali",
+    "locazione disdetta abusiva",
+    "divorzio contributo di mantenimento",
+    "assicurazione invalidità rendita",
+    "diritto di superficie iscrizione",
+    "esecuzione rigetto opposizione",
+    "permesso di dimora ricongiungimento familiare",
+]
+LEGGI = [("210", "it"), ("220", "de"), ("311.0", "fr"), ("101", "it"), ("831.10", "de"), ("142.20", "fr")]
+
+
+def url_ricerca(j, base_bgerli):
+    tema = TEMI[j % len(TEMI)]
+    if j >= len(TEMI):
+        tema += f" {j // len(TEMI) + 2000}"
+    return f"/ricerca_sentenze?query={quote(tema)}&lang=it"
+
+
+def url_sintesi(j, base_bgerli):
+    codice = fake_upstream.codice_bvger(j) if j % 5 == 4 else fake_upstream.codice_bger(j)
+    return f"/sintesi?codice={quote(codice, safe='')}&lang=it"
+
+
+def url_legge(j, base_bgerli):
+    sr, lang = LEGGI[j % len(LEGGI)]
+    # Past the first pass, single articles (art_1001, art_2001, ... exist in every fake law).
+    return f"/legge?sr={sr}&lang={lang}" + (f"&art={j // len(LEGGI) * 1000 + 1}" if j >= len(LEGGI) else "")
+
+
+def url_html_federale(j, base_bgerli):
+    codice = fake_upstream.codice_bger(j).replace("/", "-")
+    return f"/html_federale?url={quote(f'{base_bgerli}/{codice}', safe='')}&contenuto=1"
+
+
+SCENARI = {
+    "ricerca": url_ricerca,
+    "sintesi": url_sintesi,
+    "legge": url_legge,
+    "html_federale": url_html_federale,
+}
+
+
+def porta_libera() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def avvia_app(env, workers, threads, porta):
+    cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+           "-w", str(workers), "--threads", str(threads), "--timeout", "300",
+           "-b", f"127.0.0.1:{porta}", "main:app"]
+    return subprocess.Popen(cmd, cwd=RADICE, env=env)
+
+
+def attendi_app(base, processo, timeout=90):
+    scadenza = time.monotonic() + timeout
+    while time.monotonic() < scadenza:
+        if processo is not None and processo.poll() is not None:
+            raise RuntimeError(f"main.py terminato con codice {processo.returncode}")
+        try:
+            if requests.get(f"{base}/stato_llm", timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError(f"main.py non risponde su {base}")
+
+
+def percentile(ordinati, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordinati:
+        return float("nan")
+    return ordinati[max(0, min(len(ordinati) - 1, math.ceil(p / 100 * len(ordinati)) - 1))]
+
+
+def esegui_scenario(base, genera_url, base_bgerli, richieste, concorrenza, chiavi, riscaldamento):
+    """Fire richieste requests from concorrenza threads; returns (latencies s, status counts, wall s)."""
+    contatore = itertools.count()
+    latenze, stati = [], Counter()
+    lock = threading.Lock()
+    locale = threading.local()
+
+    def sessione():
+        if not hasattr(locale, "s"):
+            locale.s = requests.Session()
+            locale.s.headers["Accept-Encoding"] = "gzip, br"
+        return locale.s
+
+    def cliente(limite, registra):
+        while (i := next(contatore)) < limite:
+            t0 = time.perf_counter()
+            try:
+                r = sessione().get(base + genera_url(i % chiavi, base_bgerli), timeout=300)
+                r.content
+                stato = r.status_code
+            except requests.RequestException as e:
+                stato = type(e).__name__
+            durata = time.perf_counter() - t0
+            if registra:
+                with lock:
+                    latenze.append(durata)
+                    stati[stato] += 1
+
+    if riscaldamento:
+        with ThreadPoolExecutor(concorrenza) as ex:
+            for _ in range(concorrenza):
+                ex.submit(cliente, riscaldamento, False)
+        contatore = itertools.count()
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concorrenza) as ex:
+        for fut in [ex.submit(cliente, richieste, True) for _ in range(concorrenza)]:
+            fut.result()
+    return sorted(latenze), stati, time.perf_counter() - t0
+
+
+def fasi_da_metriche(testo):
+    """{fase: (count, mean ms)} from the sententia_fase_secondi histogram."""
+    somme, conteggi = {}, {}
+    for riga in testo.splitlines():
+        m = re.match(r'sententia_fase_secondi_(sum|count)\{fase="([^"]+)"\} (\S+)', riga)
+        if m:
+            (somme if m.group(1) == "sum" else conteggi)[m.group(2)] = float(m.group(3))
+    return {f: (int(conteggi[f]), somme[f] / conteggi[f] * 1000) for f in sorted(conteggi) if conteggi[f]}
+
+
+def main_carico():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-c", "--concorrenza", type=int, default=8)
+    ap.add_argument("-n", "--richieste", type=int, default=200, help="measured requests per scenario")
+    ap.add_argument("--scenari", default=",".join(SCENARI), help=f"comma-separated, among {', '.join(SCENARI)}")
+    ap.add_argument("--chiavi", type=int, default=20, help="distinct decisions/queries/laws per scenario")
+    ap.add_argument("--riscaldamento", type=int, default=0, help="unmeasured requests before each scenario")
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--json", metavar="FILE", help="write the results as JSON")
+    ap.add_argument("--tieni-cache", action="store_true", help="keep CACHE_DIR and print its path")
+    fake_upstream.aggiungi_argomenti(ap)
+    args = ap.parse_args()
+
+    scenari = [s.strip() for s in args.scenari.split(",") if s.strip()]
+    sconosciuti = [s for s in scenari if s not in SCENARI]
+    if sconosciuti:
+        ap.error(f"scenari sconosciuti: {', '.join(sconosciuti)}")
+
+    upstream = fake_upstream.avvia(fake_upstream.config_da_argomenti(args))
+    cache_dir = tempfile.mkdtemp(prefix="sententia-bench-")
+    env = dict(os.environ, **upstream.env(),
+               CACHE_DIR=cache_dir, RATELIMIT_ENABLED="0",
+               OPENAI_API_KEY="bench", GOOGLE_API_KEY="bench", GOOGLE_CSE_ID="bench")
+    porta = porta_libera()
+    base = f"http://127.0.0.1:{porta}"
+    processo = avvia_app(env, args.workers, args.threads, porta)
+    risultati = {}
+    try:
+        attendi_app(base, processo)
+        print(f"{'scenario':<14} {'req':>6} {'non-2xx':>8} {'req/s':>8} "
+              f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for nome in scenari:
+            latenze, stati, durata = esegui_scenario(
+                base, SCENARI[nome], upstream.env()["BGER_LI_BASE"],
+                args.richieste, args.concorrenza, args.chiavi, args.riscaldamento)
+            errori = {str(k): v for k, v in stati.items() if not (isinstance(k, int) and 200 <= k < 300)}
+            risultati[nome] = {
+                "richieste": len(latenze), "errori": errori, "rps": len(latenze) / durata,
+                **{f"p{p}_ms": percentile(latenze, p) * 1000 for p in (50, 95, 99)},
+                "max_ms": latenze[-1] * 1000 if latenze else float("nan"),
+            }
+            r = risultati[nome]
+            print(f"{nome:<14} {r['richieste']:>6} {sum(errori.values()):>8} {r['rps']:>8.1f} "
+                  f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}"
+                  + (f"  {errori}" if errori else ""))
+
+        fasi = fasi_da_metriche(requests.get(f"{base}/metrics", timeout=10).text)
+        if fasi:
+            print(f"\n{'fase':<20} {'n':>7} {'media ms':>9}")
+            for fase, (n, media) in fasi.items():
+                print(f"{fase:<20} {n:>7} {media:>9.1f}")
+        print(f"\nupstream: {dict(sorted(upstream.config.conteggi.items()))}")
+    finally:
+        processo.terminate()
+        try:
+            processo.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            processo.kill()
+        upstream.shutdown()
+        if args.tieni_cache:
+            print(f"CACHE_DIR: {cache_dir}")
+        else:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if args.json:
+        parametri = {k: v for k, v in vars(args).items() if k != "json"}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"parametri": parametri, "scenari": risultati,
+                       "fasi": {k: {"n": n, "media_ms": m} for k, (n, m) in fasi.items()}}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_carico())
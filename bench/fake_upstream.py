@@ -0,0 +1,371 @@
+"""Local stand-ins for every upstream main.py talks to, for offline benchmarks.
+
+    python bench/fake_upstream.py                               # port 8900, no latency
+    python bench/fake_upstream.py --latenza openai=800:300,cse=150 --errori bgerli=0.02
+    python bench/fake_upstream.py --env                         # print the variables for main.py
+
+One HTTP server, one path prefix per service (bench/carico.py starts it and
+points main.py at it by itself):
+
+    /cse          Google Custom Search               CSE_ENDPOINT
+    /openai/v1    OpenAI chat completions            OPENAI_BASE_URL
+    /bgerli       bger.li decision pages             BGER_LI_BASE
+    /jina         r.jina.ai (DuckDuckGo, bvger)      JINA_BASE
+    /sparql       Fedlex SPARQL endpoint             SPARQL_ENDPOINT
+    /fedlex       Fedlex law HTML (linked by /sparql)
+    /translate    Google Translate web page          GOOGLE_TRANSLATE_URL
+
+Responses are built from the recorded fixtures in bench/fixtures and the law
+extracts in bench/corpus, so main.py parses them exactly like the real ones.
+Latency is "ms" or "ms:jitter" per service; errors are a failure probability
+per service, answered with 503 (429 with Retry-After for openai).
+"""
+import argparse
+import functools
+import glob
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+QUI = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(QUI, "fixtures")
+CORPUS_DIR = os.path.join(QUI, "corpus")
+
+SERVIZI = ("cse", "openai", "bgerli", "jina", "sparql", "fedlex", "translate")
+POOL_SENTENZE = 500  # distinct decision codes the fake CSE can return
+
+
+@functools.lru_cache(maxsize=None)
+def fixture(nome: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, nome), encoding="utf-8") as f:
+        return f.read()
+
+
+def codice_bger(i: int) -> str:
+    """The i-th decision code of the fake corpus, e.g. "4A_117/2023"."""
+    i %= POOL_SENTENZE
+    return f"{1 + i % 9}{'ABCDFG'[i // 9 % 6]}_{100 + i}/2023"
+
+
+def codice_bvger(i: int) -> str:
+    return f"{'ABCDEF'[i % 6]}-{1000 + i % POOL_SENTENZE}/2023"
+
+
+@functools.lru_cache(maxsize=256)
+def pagina_sentenza(codice: str, ripeti: int) -> str:
+    """A bger.li page for codice: the recorded page with its considerations repeated ripeti times."""
+    testa, resto = fixture("sentenza_bger.html").split("<!--ripeti-->")
+    blocco, coda = resto.split("<!--/ripeti-->")
+    corpo = "".join(blocco.replace("{{N}}", str(n)) for n in range(2, 2 + ripeti))
+    html = testa + corpo + coda.replace("{{FINE}}", str(2 + ripeti))
+    return html.replace("{{CODICE}}", codice).replace("{{CODICE_URL}}", codice.replace("/", "-"))
+
+
+def risultati_cse(query: str, num: int) -> dict:
+    """Recorded CSE response with num hits chosen deterministically from the query."""
+    risposta = json.loads(fixture("cse.json"))
+    modello = json.dumps(risposta["items"][0])
+    inizio = zlib.crc32(query.encode()) % POOL_SENTENZE
+    risposta["items"] = [
+        json.loads(modello.replace("{{CODICE}}", codice_bger(inizio + k))
+                   .replace("{{DOCID}}", f"14-03-2023-{codice_bger(inizio + k).replace('/', '-')}"))
+        for k in range(num)
+    ]
+    return risposta
+
+
+@functools.lru_cache(maxsize=64)
+def legge_html(sr: str, lang: str, ripeti: int) -> bytes:
+    """Fedlex HTML for (sr, lang): a corpus extract with its body repeated to a realistic size."""
+    corpus = sorted(glob.glob(os.path.join(CORPUS_DIR, "*.html")))
+    with open(corpus[zlib.crc32(sr.encode()) % len(corpus)], encoding="utf-8") as f:
+        html = f.read()
+    testa, resto = html.split('<main id="maintext">', 1)
+    corpo, coda = resto.split("</main>", 1)
+    copie = []
+    for k in range(ripeti):
+        copia = re.sub(r'"(#?)art_(\d+)', lambda m: f'"{m.group(1)}art_{k * 1000 + int(m.group(2))}', corpo)
+        copie.append(re.sub(r'"(#?)lvl_', rf'"\1lvl_{k}_', copia))
+    html = testa + '<main id="maintext">' + "".join(copie) + "</main>" + coda
+    return html.replace('lang="it"', f'lang="{lang}"').encode("utf-8")
+
+
+def uuid_bvger(testo: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, testo))
+
+
+class Config:
+    def __init__(self, latenza=None, errori=None, ripeti_sentenza=12, ripeti_legge=200,
+                 token_ms=0.0, seed=None):
+        self.latenza = latenza or {}  # servizio -> (ms, jitter ms)
+        self.errori = errori or {}    # servizio -> probability
+        self.ripeti_sentenza = ripeti_sentenza
+        self.ripeti_legge = ripeti_legge
+        self.token_ms = token_ms
+        self.random = random.Random(seed)
+        self.conteggi = Counter()
+        self._lock = threading.Lock()
+
+    def conta(self, chiave):
+        with self._lock:
+            self.conteggi[chiave] += 1
+
+    def attendi(self, servizio):
+        ms, jitter = self.latenza.get(servizio, (0.0, 0.0))
+        with self._lock:
+            ms += self.random.uniform(-jitter, jitter)
+        if ms > 0:
+            time.sleep(ms / 1000)
+
+    def fallisce(self, servizio) -> bool:
+        p = self.errori.get(servizio, 0.0)
+        with self._lock:
+            return p > 0 and self.random.random() < p
+
+
+def _parse_per_servizio(valore: str, coppia: bool) -> dict:
+    """Parse "openai=800:200,cse=150" (coppia) or "openai=0.05,bgerli=0.1"."""
+    risultato = {}
+    for voce in filter(None, (v.strip() for v in (valore or "").split(","))):
+        servizio, _, numeri = voce.partition("=")
+        if servizio not in SERVIZI:
+            raise argparse.ArgumentTypeError(f"servizio sconosciuto: {servizio} (validi: {', '.join(SERVIZI)})")
+        if coppia:
+            ms, _, jitter = numeri.partition(":")
+            risultato[servizio] = (float(ms), float(jitter or 0))
+        else:
+            risultato[servizio] = float(numeri)
+    return risultato
+
+
+def parse_latenza(valore):
+    return _parse_per_servizio(valore, True)
+
+
+def parse_errori(valore):
+    return _parse_per_servizio(valore, False)
+
+
+class Gestore(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeUpstream/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def config(self) -> Config:
+        return self.server.config
+
+    def _servizio(self):
+        return self.path.lstrip("/").split("/", 1)[0].split("?", 1)[0]
+
+    def _invia(self, status, corpo, tipo="application/json", headers=None):
+        if isinstance(corpo, str):
+            corpo = corpo.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(corpo)
+
+    def _json(self, dati, status=200):
+        self._invia(status, json.dumps(dati, ensure_ascii=False))
+
+    def _corpo(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _gestisci(self):
+        servizio = self._servizio()
+        if servizio not in SERVIZI:
+            return self._json({"error": f"unknown service {servizio}"}, 404)
+        self.config.conta(servizio)
+        self.config.attendi(servizio)
+        if self.config.fallisce(servizio):
+            self.config.conta(f"{servizio}_errori")
+            if servizio == "openai":
+                self._corpo()
+                return self._json({"error": {"message": "Rate limit reached", "type": "requests"}}, 429)
+            return self._invia(503, "Service Unavailable", "text/plain")
+        getattr(self, f"_{servizio}")()
+
+    do_GET = do_POST = do_HEAD = _gestisci
+
+    def _cse(self):
+        args = parse_qs(urlsplit(self.path).query)
+        query = args.get("q", [""])[0]
+        self._json(risultati_cse(query, int(args.get("num", ["10"])[0])))
+
+    def _translate(self):
+        args = parse_qs(urlsplit(self.path).query)
+        testo, lingua = args.get("q", [""])[0], args.get("tl", ["en"])[0]
+        self._invia(200, f'<html><body><div class="t0">{testo} ({lingua})</div></body></html>', "text/html")
+
+    def _bgerli(self):
+        codice = unquote(self.path.split("/", 2)[2].split("?", 1)[0])
+        codice = re.sub(r"^(\d+[A-Z])-(\d+)-(\d+)$", r"\1_\2/\3", codice)
+        self._invia(200, pagina_sentenza(codice, self.config.ripeti_sentenza), "text/html; charset=utf-8")
+
+    def _jina(self):
+        bersaglio = unquote(self.path.split("/", 2)[2])
+        if "duckduckgo.com" in bersaglio:
+            q = parse_qs(urlsplit(bersaglio).query).get("q", [""])[0]
+            codice = q.split(" site:", 1)[0]
+            testo = (f"Title: {q} at DuckDuckGo\n\n{codice} - Bundesverwaltungsgericht\n"
+                     f"https://bvger.weblaw.ch/cache?guiLanguage=de&id={uuid_bvger(codice)}\n")
+        else:
+            uid = parse_qs(urlsplit(bersaglio).query).get("id", [""])[0]
+            testo = fixture("bvger.txt").replace("{{UUID}}", uid).replace("{{CODICE}}", f"X-{uid[:4]}/2023")
+        self._invia(200, testo, "text/plain; charset=utf-8")
+
+    def _sparql(self):
+        query = parse_qs(self._corpo().decode("utf-8")).get("query", [""])[0]
+        base = f"http://{self.headers.get('Host')}/fedlex"
+        bindings = [
+            {"sr": {"type": "literal", "value": sr}, "lang": {"type": "literal", "value": lang},
+             "best": {"type": "literal",
+                      "value": f"https://fedlex.data.admin.ch/eli/cc/{sr}/20240101|{base}/{sr}_{lang}.html"}}
+            for sr, lang in re.findall(r'\("([^"]+)" "([a-z]{2})"\)', query)
+        ]
+        self._invia(200, json.dumps({"head": {"vars": ["sr", "lang", "best"]}, "results": {"bindings": bindings}}),
+                    "application/sparql-results+json")
+
+    def _fedlex(self):
+        m = re.fullmatch(r"/fedlex/(.+)_([a-z]{2})\.html", urlsplit(self.path).path)
+        if not m:
+            return self._invia(404, "Not Found", "text/plain")
+        corpo = legge_html(m.group(1), m.group(2), self.config.ripeti_legge)
+        etag = f'"{zlib.crc32(corpo):08x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            return self.end_headers()
+        self._invia(200, corpo, "text/html; charset=utf-8", {"ETag": etag})
+
+    def _openai(self):
+        richiesta = json.loads(self._corpo() or b"{}")
+        testo = fixture("openai_sintesi.txt").strip()
+        prompt = sum(len(m.get("content", "")) for m in richiesta.get("messages", [])) // 4
+        completion = len(testo) // 4
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "created": int(time.time()),
+                "model": richiesta.get("model", "gpt-4o")}
+        if not richiesta.get("stream"):
+            return self._json({
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": testo}}],
+                "usage": {"prompt_tokens": prompt, "completion_tokens": completion,
+                          "total_tokens": prompt + completion},
+            })
+
+        # Server-sent events until the connection closes, like the real API.
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for parola in re.findall(r"\S+\s*", testo):
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": parola}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if self.config.token_ms:
+                time.sleep(self.config.token_ms / 1000)
+        fine = {**base, "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self.wfile.write(f"data: {json.dumps(fine)}\n\n".encode("utf-8"))
+        if (richiesta.get("stream_options") or {}).get("include_usage"):
+            usage = {**base, "object": "chat.completion.chunk", "choices": [],
+                     "usage": {"prompt_tokens": prompt, "completion_tokens": completion,
+                               "total_tokens": prompt + completion}}
+            self.wfile.write(f"data: {json.dumps(usage)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class ServerFinto(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, indirizzo, config: Config):
+        super().__init__(indirizzo, Gestore)
+        self.config = config
+
+    @property
+    def base(self) -> str:
+        host, porta = self.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def env(self) -> dict:
+        """Environment variables that point main.py at this server."""
+        return {
+            "CSE_ENDPOINT": f"{self.base}/cse",
+            "OPENAI_BASE_URL": f"{self.base}/openai/v1",
+            "BGER_LI_BASE": f"{self.base}/bgerli",
+            "JINA_BASE": f"{self.base}/jina",
+            "SPARQL_ENDPOINT": f"{self.base}/sparql",
+            "GOOGLE_TRANSLATE_URL": f"{self.base}/translate",
+        }
+
+
+def avvia(config: Config, host="127.0.0.1", porta=0) -> ServerFinto:
+    """Start the fake upstreams in a background thread (porta=0 picks a free port)."""
+    server = ServerFinto((host, porta), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def aggiungi_argomenti(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--latenza", type=parse_latenza, default={},
+                    help='per-service latency "servizio=ms[:jitter],...", e.g. openai=800:300,cse=150')
+    ap.add_argument("--errori", type=parse_errori, default={},
+                    help='per-service failure probability, e.g. openai=0.05,bgerli=0.02')
+    ap.add_argument("--token-ms", type=float, default=0.0, help="delay between streamed OpenAI chunks")
+    ap.add_argument("--ripeti-sentenza", type=int, default=12,
+                    help="considerations per decision page (12 ~ a 30 KB decision)")
+    ap.add_argument("--ripeti-legge", type=int, default=200,
+                    help="copies of the corpus extract per law (200 ~ 600 KB of HTML)")
+    ap.add_argument("--seed", type=int, default=None)
+
+
+def config_da_argomenti(args) -> Config:
+    return Config(args.latenza, args.errori, args.ripeti_sentenza, args.ripeti_legge,
+                  args.token_ms, args.seed)
+
+
+def main_fake():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--porta", type=int, default=8900)
+    ap.add_argument("--env", action="store_true", help="print the environment for main.py and exit")
+    aggiungi_argomenti(ap)
+    args = ap.parse_args()
+
+    server = ServerFinto((args.host, args.porta), config_da_argomenti(args))
+    if args.env:
+        for k, v in server.env().items():
+            print(f"export {k}={v}")
+        return 0
+    print(f"upstream finti su {server.base}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(dict(server.config.conteggi), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_fake())
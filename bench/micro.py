@@ -0,0 +1,83 @@
+"""Microbenchmarks for the CPU-bound steps of main.py, on the fake upstream documents.
+
+    python bench/micro.py                      # all benchmarks, best of 5
+    python bench/micro.py -n 20 --solo chunk   # only names containing "chunk"
+
+Inputs come from bench/fake_upstream.py at a few sizes, so the numbers are
+comparable with bench/carico.py runs:
+
+    parse_fedlex      _parse_fedlex_html on laws of ~30 KB, ~300 KB and ~1.5 MB
+    testo_sentenza    estrai_testo_sentenza parsing (lxml)
+    sezioni_sentenza  splitting the text into regesto/fatti/considerandi/dispositivo
+    split_in_chunks   cold (token memo cleared) and warm (same document again)
+
+split_in_chunks needs the tokenizer tables: run once online, or set
+TIKTOKEN_CACHE_DIR to a directory that already holds them.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+QUI = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(QUI))
+sys.path.insert(0, QUI)
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="sententia-micro-"))
+
+import fake_upstream  # noqa: E402
+import main  # noqa: E402
+
+
+def cronometra(fn, ripetizioni, prima=None):
+    """Best wall time in ms over ripetizioni calls; prima() runs untimed before each call."""
+    migliore = float("inf")
+    for _ in range(ripetizioni):
+        if prima:
+            prima()
+        t0 = time.perf_counter()
+        fn()
+        migliore = min(migliore, time.perf_counter() - t0)
+    return migliore * 1000
+
+
+def benchmark():
+    """Yield (name, input size in KB, fn, prima)."""
+    for ripeti in (10, 100, 500):
+        html = fake_upstream.legge_html("210", "it", ripeti).decode("utf-8")
+        yield f"parse_fedlex x{ripeti}", len(html), lambda h=html: main._parse_fedlex_html(h), None
+
+    for ripeti in (4, 12, 60):
+        html = fake_upstream.pagina_sentenza(fake_upstream.codice_bger(ripeti), ripeti)
+        yield f"testo_sentenza x{ripeti}", len(html), lambda h=html: main.testo_contenuto_sentenza(h), None
+
+    for ripeti in (12, 60, 240):
+        testo = main.testo_contenuto_sentenza(fake_upstream.pagina_sentenza(fake_upstream.codice_bger(ripeti), ripeti))
+        yield f"sezioni_sentenza x{ripeti}", len(testo), lambda t=testo: main.sezioni_sentenza(t), None
+        yield (f"split_in_chunks x{ripeti} freddo", len(testo),
+               lambda t=testo: main.split_in_chunks(t, 2000), main._token_memo.clear)
+        yield (f"split_in_chunks x{ripeti} caldo", len(testo),
+               lambda t=testo: main.split_in_chunks(t, 2000), None)
+
+
+def main_micro():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("-n", "--ripetizioni", type=int, default=5)
+    ap.add_argument("--solo", default="", help="run only benchmarks whose name contains this")
+    args = ap.parse_args()
+
+    print(f"{'benchmark':<30} {'KB':>7} {'ms':>9}")
+    for nome, dimensione, fn, prima in benchmark():
+        if args.solo not in nome:
+            continue
+        try:
+            ms = cronometra(fn, args.ripetizioni, prima)
+        except Exception as e:
+            print(f"{nome:<30} {dimensione // 1024:>7} {'errore':>9}  {type(e).__name__}: {e}")
+            continue
+        print(f"{nome:<30} {dimensione // 1024:>7} {ms:>9.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_micro())
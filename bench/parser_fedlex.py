@@ -0,0 +1,104 @@
+"""Equivalence check and microbenchmark: lxml vs regex fedlex parser.
+
+    python bench/parser_fedlex.py                 # corpus + snapshots already downloaded
+    python bench/parser_fedlex.py --scarica       # download ZGB/OR/StGB snapshots first
+    python bench/parser_fedlex.py -n 20 file.html # explicit files, 20 repetitions
+
+Exits with status 1 if the two parsers disagree on any input. Outputs are
+compared exactly as /legge would serve them: no entity decoding or whitespace
+normalization, since either would change the response bytes.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+QUI = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(QUI))
+
+import main  # noqa: E402
+
+SNAPSHOT_DIR = os.path.join(QUI, "snapshots")
+SNAPSHOT_LEGGI = {"zgb": "210", "or": "220", "stgb": "311.0"}
+SNAPSHOT_LINGUE = ("de", "fr", "it")
+
+
+def scarica_snapshot():
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    for nome, sr in SNAPSHOT_LEGGI.items():
+        for lang in SNAPSHOT_LINGUE:
+            url = main._sparql_html_url(sr, lang)
+            if not url:
+                print(f"  {nome}/{lang}: URL non trovato", file=sys.stderr)
+                continue
+            r = main.http_get(url, timeout=60)
+            r.raise_for_status()
+            r.encoding = "utf-8"
+            percorso = os.path.join(SNAPSHOT_DIR, f"{nome}_{lang}.html")
+            with open(percorso, "w", encoding="utf-8") as f:
+                f.write(r.text)
+            print(f"  {percorso} ({len(r.text) // 1024} KB)")
+
+
+def prima_differenza(a, b, percorso="$"):
+    if type(a) is not type(b):
+        return f"{percorso}: {a!r} != {b!r}"
+    if isinstance(a, dict):
+        for k in sorted(set(a) | set(b)):
+            d = prima_differenza(a.get(k), b.get(k), f"{percorso}.{k}")
+            if d:
+                return d
+    elif isinstance(a, list):
+        for i, (x, y) in enumerate(zip(a, b)):
+            d = prima_differenza(x, y, f"{percorso}[{i}]")
+            if d:
+                return d
+        if len(a) != len(b):
+            return f"{percorso}: lunghezza {len(a)} != {len(b)}"
+    elif a != b:
+        return f"{percorso}: {a!r} != {b!r}"
+    return None
+
+
+def cronometra(fn, testo, ripetizioni):
+    migliore = float("inf")
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        fn(testo)
+        migliore = min(migliore, time.perf_counter() - t0)
+    return migliore * 1000
+
+
+def main_bench():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("files", nargs="*")
+    ap.add_argument("-n", "--ripetizioni", type=int, default=5)
+    ap.add_argument("--scarica", action="store_true", help="download ZGB/OR/StGB snapshots from fedlex")
+    args = ap.parse_args()
+
+    if args.scarica:
+        scarica_snapshot()
+    files = args.files or sorted(glob.glob(os.path.join(QUI, "corpus", "*.html"))
+                                 + glob.glob(os.path.join(SNAPSHOT_DIR, "*.html")))
+
+    print(f"{'file':<24} {'KB':>6} {'elem':>6} {'regex ms':>9} {'lxml ms':>9} {'x':>5}  esito")
+    divergenze = 0
+    for percorso in files:
+        with open(percorso, encoding="utf-8") as f:
+            testo = f.read()
+        atteso = main._parse_fedlex_html_regex(testo)
+        ottenuto = main._parse_fedlex_html_lxml(testo)
+        diff = prima_differenza(list(atteso), list(ottenuto))
+        t_regex = cronometra(main._parse_fedlex_html_regex, testo, args.ripetizioni)
+        t_lxml = cronometra(main._parse_fedlex_html_lxml, testo, args.ripetizioni)
+        print(f"{os.path.basename(percorso):<24} {len(testo) // 1024:>6} {len(ottenuto[1]):>6} "
+              f"{t_regex:>9.1f} {t_lxml:>9.1f} {t_regex / t_lxml:>5.1f}  {'ok' if not diff else 'DIVERSO'}")
+        if diff:
+            divergenze += 1
+            print(f"    {diff}")
+    return 1 if divergenze else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_bench())
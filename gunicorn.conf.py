@@ -0,0 +1,32 @@
+import gc
+import os
+
+wsgi_app = "main:app"
+
+# Load the app in the master and fork workers from it, so the heavy libraries
+# and tokenizer tables are shared copy-on-write. GUNICORN_PRELOAD=0 restores
+# per-worker loading (needed for code reloads with HUP).
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    try:
+        from main import precarica
+        precarica()
+    except Exception as e:
+        server.log.warning("Precaricamento fallito: %s", e)
+    # Keep the preloaded objects out of the collector: a full collection in a
+    # worker would otherwise touch their headers and unshare every page.
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Load the tokenizer tables at boot instead of on the first summary request
+    # (a no-op when they were preloaded in the master).
+    try:
+        from main import encoder
+        encoder()
+    except Exception as e:
+        worker.log.warning("Tokenizer warm-up fallito: %s", e)
@@ -1,160 +1,1698 @@
 import os
 import re
+import json
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from flask import Flask, request, jsonify
+import queue
+import zlib
+import gzip
+import hashlib
+import sqlite3
+import threading
+import contextlib
+import atexit
+import functools
+import inspect
+import contextvars
+import heapq
+import itertools
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import click
 import requests
-from bs4 import BeautifulSoup
-from deep_translator import GoogleTranslator
-from openai import OpenAI
-import tiktoken
+from requests.adapters import HTTPAdapter
+from lxml import etree
+import brotli
 from dotenv import load_dotenv
 
+# openai, tiktoken and deep_translator are imported where first used:
+# importing main must stay cheap for CLI commands, benchmarks and tests.
+
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GOOGLE_CSE_ID  = os.getenv("GOOGLE_CSE_ID")
+MODEL  = "gpt-4o-mini"
 
-if not (OPENAI_API_KEY and GOOGLE_API_KEY and GOOGLE_CSE_ID):
-    raise ValueError("Chiavi API mancanti nel file .env.")
+_client = None
+_client_lock = threading.Lock()
+
+
+def client_openai():
+    """Return the OpenAI client, built on first use in each process."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not OPENAI_API_KEY:
+                    raise ValueError("OPENAI_API_KEY mancante nel file .env.")
+                from openai import OpenAI
+                _client = OpenAI(api_key=OPENAI_API_KEY)
+    return _client
 
-client = OpenAI(api_key=OPENAI_API_KEY)
-MODEL  = "gpt-4o-mini"
 
-app = Flask(__name__)
-CORS(app)
+# Routes, hooks and CLI commands live on this blueprint; create_app() builds the app.
+bp = Blueprint("sententia", __name__, cli_group=None)
 
 limiter = Limiter(
     key_func=get_remote_address,
-    app=app,
     default_limits=[],
     storage_uri="memory://",
+    enabled=os.getenv("RATELIMIT_ENABLED", "1") != "0",
 )
 
-@app.errorhandler(429)
+@bp.app_errorhandler(429)
 def troppe_richieste(e):
     return jsonify({"errore": "Limite di richieste superato. Riprova tra qualche minuto."}), 429
 
 
+# ── Cache persistente su disco (SQLite, condivisa tra i worker gunicorn) ──────
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+
+
+class SQLiteStore:
+    """Base for SQLite files in CACHE_DIR shared by all worker processes.
+
+    Connections are opened lazily per thread and per process, so stores are
+    safe across gunicorn forks. Subclasses create their tables in _crea_schema.
+    """
+
+    def __init__(self, name: str):
+        self.name   = name
+        self.path   = os.path.join(CACHE_DIR, f"{name}.sqlite3")
+        self._local = threading.local()
+        self._ready = False
+
+    def _crea_schema(self, conn: sqlite3.Connection) -> None:
+        raise NotImplementedError
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._ready:
+            self._crea_schema(conn)
+            self._ready = True
+        self._local.conn = conn
+        self._local.pid  = os.getpid()
+        return conn
+
+
+class DiskCache(SQLiteStore):
+    """SQLite key/value store shared by all worker processes, with size-bounded LRU eviction.
+
+    Values are JSON-serialized and zlib-compressed.
+    """
+
+    def __init__(self, name: str, max_bytes: int, ttl: float | None = None):
+        super().__init__(name)
+        self.max_bytes = max_bytes
+        self.ttl       = ttl
+
+    def _crea_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache(accessed)")
+
+    def get(self, key: str):
+        """Return the cached value for key, or None if missing or expired."""
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                _metriche.incrementa("sententia_cache_totale", cache=self.name, esito="miss")
+                return None
+            now = time.time()
+            if self.ttl is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                _metriche.incrementa("sententia_cache_totale", cache=self.name, esito="miss")
+                return None
+            conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            valore = self._decodifica(row[0])
+            _metriche.incrementa("sententia_cache_totale", cache=self.name, esito="hit")
+            return valore
+        except (sqlite3.Error, zlib.error, ValueError):
+            return None
+
+    def set(self, key: str, value) -> None:
+        try:
+            blob = self._codifica(value)
+            now  = time.time()
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._evict(conn)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Drop least recently used entries until the store fits in max_bytes."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        while total > self.max_bytes:
+            rows = conn.execute("SELECT key, size FROM cache ORDER BY accessed LIMIT 32").fetchall()
+            if not rows:
+                break
+            vittime = []
+            for key, size in rows:  # only as many as needed, so the entry just set survives
+                if total <= self.max_bytes:
+                    break
+                vittime.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM cache WHERE key = ?", vittime)
+
+    def _codifica(self, value) -> bytes:
+        return zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def _decodifica(self, blob: bytes):
+        return json.loads(zlib.decompress(blob))
+
+
+class BlobCache(DiskCache):
+    """DiskCache for values that already are bytes (e.g. precompressed responses), stored as-is."""
+
+    def _codifica(self, value: bytes) -> bytes:
+        return value
+
+    def _decodifica(self, blob: bytes) -> bytes:
+        return bytes(blob)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single computation."""
+
+    def __init__(self):
+        self._lock  = threading.Lock()
+        self._calls: dict = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = Future()
+                self._calls[key] = fut
+        if not leader:
+            return fut.result()
+        try:
+            result = fn()
+            fut.set_result(result)
+            return result
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+# ── Metriche Prometheus (/metrics) e Server-Timing per fase ───────────────────
+
+METRICHE_BUCKET = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+METRICHE_FLUSH  = float(os.getenv("METRICHE_FLUSH", "5"))
+
+DESCRIZIONE_METRICHE = {
+    "sententia_richiesta_secondi":      ("histogram", "Request latency by endpoint."),
+    "sententia_risposte_totale":        ("counter",   "Responses by endpoint and status code."),
+    "sententia_fase_secondi":           ("histogram", "Latency of each processing stage."),
+    "sententia_cache_totale":           ("counter",   "Cache lookups by cache and outcome."),
+    "sententia_upstream_secondi":       ("histogram", "Upstream HTTP latency by host."),
+    "sententia_upstream_totale":        ("counter",   "Upstream HTTP requests by host and outcome."),
+    "sententia_upstream_errori_totale": ("counter",   "Upstream failures (network errors, 429, 5xx) by host."),
+    "sententia_llm_token_totale":       ("counter",   "OpenAI tokens spent, prompt and completion."),
+    "sententia_sezioni_totale":         ("counter",   "Summary inputs sent by section or, when unsegmentable, whole."),
+}
+
+
+def _avvio_processo(pid: int) -> float | None:
+    """Start time of pid in clock ticks since boot (Linux /proc), or None where unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            return float(f.read().rsplit(b")", 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _processo_vivo(pid: int, avvio: float) -> bool:
+    """False only when process (pid, avvio) has certainly exited (pid reuse counts as exited)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    attuale = _avvio_processo(pid)
+    return attuale is None or attuale == avvio
+
+
+class Metriche(SQLiteStore):
+    """Counters and histograms kept in memory and flushed per process to SQLite.
+
+    Each process writes its own cumulative values under (pid, start time), so
+    /metrics on any worker reports the sum over all of them. Rows of processes
+    that have exited are folded into one aggregate row (pid 0) and dropped.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lock   = threading.Lock()
+        self._valori: dict = {}  # (nome, etichette) -> valore
+        self._ultimo_flush = 0.0
+        self._avvio = self._avvio_corrente()
+        # A forked worker starts from zero: the parent's values stay the parent's.
+        os.register_at_fork(after_in_child=self._dopo_fork)
+
+    @staticmethod
+    def _avvio_corrente() -> float:
+        # Without /proc, a negative wall-clock time: unique enough and never equal to a tick count.
+        return _avvio_processo(os.getpid()) or -time.time()
+
+    def _dopo_fork(self) -> None:
+        self._lock   = threading.Lock()
+        self._valori = {}
+        self._ultimo_flush = 0.0
+        self._avvio = self._avvio_corrente()
+
+    def _crea_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS contatori ("
+            " pid INTEGER NOT NULL, avvio REAL NOT NULL, nome TEXT NOT NULL, etichette TEXT NOT NULL,"
+            " valore REAL NOT NULL, PRIMARY KEY (pid, avvio, nome, etichette))"
+        )
+
+    @staticmethod
+    def _etichette(etichette: dict) -> str:
+        return ",".join(f'{k}="{_escape_etichetta(v)}"' for k, v in sorted(etichette.items()))
+
+    def incrementa(self, nome: str, valore: float = 1, **etichette) -> None:
+        key = (nome, self._etichette(etichette))
+        with self._lock:
+            self._valori[key] = self._valori.get(key, 0) + valore
+
+    def osserva(self, nome: str, secondi: float, **etichette) -> None:
+        base = self._etichette(etichette)
+        sep  = "," if base else ""
+        with self._lock:
+            for le in METRICHE_BUCKET:
+                if secondi <= le:
+                    key = (f"{nome}_bucket", f'{base}{sep}le="{le}"')
+                    self._valori[key] = self._valori.get(key, 0) + 1
+            for key, inc in (((f"{nome}_bucket", f'{base}{sep}le="+Inf"'), 1),
+                             ((f"{nome}_count", base), 1), ((f"{nome}_sum", base), secondi)):
+                self._valori[key] = self._valori.get(key, 0) + inc
+
+    def salva(self, forza: bool = False) -> None:
+        if not forza and time.time() - self._ultimo_flush < METRICHE_FLUSH:
+            return
+        self._ultimo_flush = time.time()
+        with self._lock:
+            righe = [(os.getpid(), self._avvio, nome, etichette, v) for (nome, etichette), v in self._valori.items()]
+        try:
+            self._conn().executemany(
+                "INSERT OR REPLACE INTO contatori (pid, avvio, nome, etichette, valore) VALUES (?, ?, ?, ?, ?)",
+                righe,
+            )
+        except sqlite3.Error:
+            pass
+
+    def _accorpa_terminati(self, conn: sqlite3.Connection) -> None:
+        """Fold the rows of processes that have exited into the aggregate row."""
+        processi = conn.execute("SELECT DISTINCT pid, avvio FROM contatori WHERE pid != 0").fetchall()
+        terminati = [(pid, avvio) for pid, avvio in processi if not _processo_vivo(pid, avvio)]
+        if not terminati:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for pid, avvio in terminati:
+                conn.execute(
+                    "INSERT INTO contatori (pid, avvio, nome, etichette, valore)"
+                    " SELECT 0, 0, nome, etichette, valore FROM contatori WHERE pid = ? AND avvio = ?"
+                    " ON CONFLICT(pid, avvio, nome, etichette) DO UPDATE SET valore = valore + excluded.valore",
+                    (pid, avvio),
+                )
+                conn.execute("DELETE FROM contatori WHERE pid = ? AND avvio = ?", (pid, avvio))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def esporta(self) -> str:
+        """Prometheus text exposition of the values summed over all processes."""
+        self.salva(forza=True)
+        try:
+            conn = self._conn()
+            self._accorpa_terminati(conn)
+            righe = conn.execute(
+                "SELECT nome, etichette, SUM(valore) FROM contatori GROUP BY nome, etichette ORDER BY nome, etichette"
+            ).fetchall()
+        except sqlite3.Error:
+            righe = []
+        righe.sort(key=lambda r: (r[0], _le_ordinabile(r[1])))
+        linee, dichiarate = [], set()
+        for nome, etichette, valore in righe:
+            famiglia = re.sub(r"_(bucket|count|sum)$", "", nome) if nome not in DESCRIZIONE_METRICHE else nome
+            if famiglia not in dichiarate and famiglia in DESCRIZIONE_METRICHE:
+                tipo, aiuto = DESCRIZIONE_METRICHE[famiglia]
+                linee += [f"# HELP {famiglia} {aiuto}", f"# TYPE {famiglia} {tipo}"]
+                dichiarate.add(famiglia)
+            linee.append(f"{nome}{{{etichette}}} {valore:.12g}" if etichette else f"{nome} {valore:.12g}")
+        return "\n".join(linee) + "\n"
+
+
+def _escape_etichetta(valore) -> str:
+    return str(valore).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _le_ordinabile(etichette: str) -> tuple:
+    m = re.search(r'le="([^"]+)"', etichette)
+    if not m:
+        return (etichette, 0.0)
+    return (etichette[: m.start()], float("inf") if m.group(1) == "+Inf" else float(m.group(1)))
+
+
+_metriche = Metriche("metriche")
+atexit.register(_metriche.salva, True)
+
+# Per-request stage timings for Server-Timing; worker threads inherit them via EsecutoreContesto.
+_tempi_richiesta: contextvars.ContextVar = contextvars.ContextVar("tempi_richiesta", default=None)
+
+
+class TempiRichiesta:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fasi: dict = {}  # fase -> [secondi totali, chiamate]
+
+    def aggiungi(self, fase: str, secondi: float) -> None:
+        with self._lock:
+            voce = self.fasi.setdefault(fase, [0.0, 0])
+            voce[0] += secondi
+            voce[1] += 1
+
+    def server_timing(self) -> str:
+        with self._lock:
+            return ", ".join(f'{fase};dur={s * 1000:.1f};desc="{n}x"' for fase, (s, n) in self.fasi.items())
+
+
+def registra_fase(fase: str, secondi: float) -> None:
+    _metriche.osserva("sententia_fase_secondi", secondi, fase=fase)
+    tempi = _tempi_richiesta.get()
+    if tempi is not None:
+        tempi.aggiungi(fase, secondi)
+
+
+@contextlib.contextmanager
+def fase(nome: str):
+    """Record the duration of a block as stage nome."""
+    inizio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registra_fase(nome, time.perf_counter() - inizio)
+
+
+def misura(fase: str):
+    """Decorator recording the duration of a stage (for generators: until exhausted)."""
+    def decora(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generatore(*args, **kwargs):
+                inizio = time.perf_counter()
+                try:
+                    yield from fn(*args, **kwargs)
+                finally:
+                    registra_fase(fase, time.perf_counter() - inizio)
+            return generatore
+
+        @functools.wraps(fn)
+        def funzione(*args, **kwargs):
+            inizio = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                registra_fase(fase, time.perf_counter() - inizio)
+        return funzione
+    return decora
+
+
+class EsecutoreContesto(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks run in a copy of the submitter's context (request timings)."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# Published decisions never change: texts are kept until evicted by size.
+_testi_cache = DiskCache("testi_sentenze", int(os.getenv("TESTI_CACHE_MB", "512")) * 1024 * 1024)
+_testi_inflight = SingleFlight()
+
+
+# ── Client HTTP condiviso (keep-alive, pool per host, retry, timeout uniformi) ──
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_POOL_SIZE       = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_RETRIES         = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_AFTER_MAX = float(os.getenv("HTTP_RETRY_AFTER_MAX", "10"))  # cap on a server-requested wait
+HTTP_RETRY_READ_MAX  = float(os.getenv("HTTP_RETRY_READ_MAX", "15"))   # longer read timeouts are not retried
+HTTP_RETRY_STATI     = (429, 500, 502, 503, 504)
+HTTP_HOST_DEFAULT_LIMIT = int(os.getenv("HTTP_HOST_DEFAULT_LIMIT", "16"))
+
+# Per-host concurrency caps, e.g. HTTP_HOST_LIMITS="bger.li=4,r.jina.ai=2"
+HTTP_HOST_LIMITS = {
+    host.strip(): int(n)
+    for host, _, n in (item.partition("=") for item in os.getenv("HTTP_HOST_LIMITS", "").split(","))
+    if host.strip() and n.strip().isdigit()
+}
+
+_http_session_pid: int | None = None
+_http_session_obj: requests.Session | None = None
+_http_session_lock = threading.Lock()
+_host_semaphores: dict = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _http_session() -> requests.Session:
+    """Return the process-wide pooled session; sockets are never shared across forks."""
+    global _http_session_obj, _http_session_pid
+    if _http_session_obj is not None and _http_session_pid == os.getpid():
+        return _http_session_obj
+    with _http_session_lock:
+        if _http_session_obj is None or _http_session_pid != os.getpid():
+            # Retries are done by http_request, outside the per-host slot.
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session_obj = session
+            _http_session_pid = os.getpid()
+        return _http_session_obj
+
+
+def _host_semaphore(host: str) -> threading.BoundedSemaphore:
+    with _host_semaphores_lock:
+        sem = _host_semaphores.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(HTTP_HOST_LIMITS.get(host, HTTP_HOST_DEFAULT_LIMIT))
+            _host_semaphores[host] = sem
+        return sem
+
+
+def _rilascia_alla_chiusura(resp: requests.Response, sem: threading.BoundedSemaphore) -> None:
+    """Make resp.close() also release sem, once."""
+    chiudi = resp.close
+    rilasciato = threading.Lock()
+
+    def close():
+        try:
+            chiudi()
+        finally:
+            if rilasciato.acquire(blocking=False):
+                sem.release()
+
+    resp.close = close
+
+
+def _attesa_retry(tentativo: int, resp: requests.Response | None = None) -> float:
+    """Exponential backoff, or the server's Retry-After if longer, at most HTTP_RETRY_AFTER_MAX seconds."""
+    attesa = 0.5 * 2 ** tentativo
+    valore = resp.headers.get("Retry-After", "").strip() if resp is not None else ""
+    if valore:
+        try:
+            attesa = max(attesa, float(valore))
+        except ValueError:
+            try:
+                attesa = max(attesa, parsedate_to_datetime(valore).timestamp() - time.time())
+            except (TypeError, ValueError, OverflowError):
+                pass
+    return min(attesa, HTTP_RETRY_AFTER_MAX)
+
+
+def _invia(method: str, url: str, timeout: float, sem: threading.BoundedSemaphore, kwargs: dict) -> requests.Response:
+    sem.acquire()
+    try:
+        resp = _http_session().request(method, url, timeout=(HTTP_CONNECT_TIMEOUT, timeout), **kwargs)
+    except BaseException:
+        sem.release()
+        raise
+    if kwargs.get("stream"):
+        _rilascia_alla_chiusura(resp, sem)
+    else:
+        sem.release()
+    return resp
+
+
+def http_request(method: str, url: str, timeout: float = 20, idempotente: bool | None = None,
+                 **kwargs) -> requests.Response:
+    """Issue a request through the shared pool, honouring the per-host concurrency cap.
+
+    timeout is the read timeout; the connect timeout is HTTP_CONNECT_TIMEOUT for every host.
+    With stream=True the host slot is held until the caller closes the response.
+    Connection errors, 429 and 5xx are retried up to HTTP_RETRIES times for
+    idempotent requests (GET/HEAD unless idempotente says otherwise); read
+    timeouts only when timeout is at most HTTP_RETRY_READ_MAX. The host slot is
+    released while waiting between attempts.
+    """
+    host = urlsplit(url).hostname or ""
+    if idempotente is None:
+        idempotente = method in ("GET", "HEAD")
+    tentativi = HTTP_RETRIES if idempotente else 0
+    inizio = time.perf_counter()
+    esito = "errore"
+    try:
+        sem = _host_semaphore(host)
+        tentativo = 0
+        while True:
+            esito = "errore"
+            try:
+                resp = _invia(method, url, timeout, sem, kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                lettura = isinstance(e, requests.ReadTimeout)
+                if tentativo == tentativi or (lettura and timeout > HTTP_RETRY_READ_MAX):
+                    raise
+                _metriche.incrementa("sententia_upstream_errori_totale", host=host)
+                time.sleep(_attesa_retry(tentativo))
+                tentativo += 1
+                continue
+            esito = f"{resp.status_code // 100}xx"
+            if resp.status_code == 429 or resp.status_code >= 500:
+                _metriche.incrementa("sententia_upstream_errori_totale", host=host)
+            if resp.status_code not in HTTP_RETRY_STATI or tentativo == tentativi:
+                return resp
+            resp.close()
+            time.sleep(_attesa_retry(tentativo, resp))
+            tentativo += 1
+    except Exception:
+        _metriche.incrementa("sententia_upstream_errori_totale", host=host)
+        raise
+    finally:
+        durata = time.perf_counter() - inizio
+        _metriche.osserva("sententia_upstream_secondi", durata, host=host)
+        _metriche.incrementa("sententia_upstream_totale", host=host, esito=esito)
+        tempi = _tempi_richiesta.get()
+        if tempi is not None:
+            tempi.aggiungi(f"http_{host}", durata)
+
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    return http_request("GET", url, **kwargs)
+
+
+def http_post(url: str, **kwargs) -> requests.Response:
+    return http_request("POST", url, **kwargs)
+
+
 # Ã¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂ UtilitÃ¢ÂÂÃÂ ÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂ  Ã¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂ
 
-def traduci_parole_chiave(parole_chiave):
-    def _traduci(target):
-        return GoogleTranslator(source="it", target=target).translate(parole_chiave)
+GLOSSARIO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "glossario_giuridico.json")
 
-    with ThreadPoolExecutor(max_workers=2) as ex:
-        fut_de = ex.submit(_traduci, "de")
-        fut_fr = ex.submit(_traduci, "fr")
+# Italian function words that carry no meaning in a keyword search.
+PAROLE_VUOTE = {
+    "a", "al", "alla", "alle", "allo", "ai", "agli", "con", "da", "dal", "dalla", "dai",
+    "di", "del", "della", "delle", "dello", "dei", "degli", "e", "ed", "fra", "gli", "i",
+    "il", "in", "la", "le", "lo", "nel", "nella", "nei", "o", "per", "su", "sul", "sulla",
+    "tra", "un", "una", "uno", "che",
+}
+
+# Upstream override for offline benchmarks (bench/fake_upstream.py).
+GOOGLE_TRANSLATE_URL = os.getenv("GOOGLE_TRANSLATE_URL")
+
+_traduzioni_cache = DiskCache("traduzioni", int(os.getenv("TRADUZIONI_CACHE_MB", "16")) * 1024 * 1024)
+_glossario = None
+
+
+def _carica_glossario() -> dict:
+    """{target: {tuple of normalized IT words: translation}}, loaded once."""
+    global _glossario
+    if _glossario is None:
+        with open(GLOSSARIO_PATH, encoding="utf-8") as f:
+            voci = json.load(f)
+        glossario = {}
+        for termine, traduzioni in voci.items():
+            for target, tradotto in traduzioni.items():
+                glossario.setdefault(target, {})[tuple(_normalizza_query(termine).split())] = tradotto
+        _glossario = glossario
+    return _glossario
+
+
+def _normalizza_query(testo: str) -> str:
+    testo = testo.lower().replace("\u2019", "'")
+    testo = re.sub(r'[,;:!?()"«»]', " ", testo)
+    return re.sub(r"\s+", " ", testo).strip()
+
+
+def _traduci_remoto(testo: str, target: str) -> str:
+    key = f"remoto|{target}|{testo}"
+    cached = _traduzioni_cache.get(key)
+    if cached:
+        return cached
+    from deep_translator import GoogleTranslator
+    traduttore = GoogleTranslator(source="it", target=target)
+    if GOOGLE_TRANSLATE_URL:
+        traduttore._base_url = GOOGLE_TRANSLATE_URL  # deep_translator has no public option for this
+    tradotto = traduttore.translate(testo)
+    if tradotto:
+        _traduzioni_cache.set(key, tradotto)
+    return tradotto
+
+
+@misura("traduzione")
+def traduci(parole_chiave, target):
+    """Translate an Italian legal query, offline whenever the glossary covers it.
+
+    Known terms (longest match first) come from glossario_giuridico.json,
+    numbers and decision codes are kept as-is, stopwords are dropped and only
+    the remaining unknown spans go to the remote translator. Results are cached
+    by normalized query.
+    """
+    query = _normalizza_query(parole_chiave)
+    key   = f"query|{target}|{query}"
+    cached = _traduzioni_cache.get(key)
+    if cached:
+        return cached
+
+    glossario  = _carica_glossario().get(target, {})
+    lunghezza  = max((len(k) for k in glossario), default=1)
+    parole     = query.split()
+    risultato  = []
+    sconosciute = []
+    completo   = True
+
+    def svuota():
+        nonlocal completo
+        while sconosciute and sconosciute[-1] in PAROLE_VUOTE:
+            sconosciute.pop()
+        if sconosciute:
+            testo = " ".join(sconosciute)
+            try:
+                risultato.append(_traduci_remoto(testo, target) or testo)
+            except Exception:
+                risultato.append(testo)
+                completo = False
+        sconosciute.clear()
+
+    i = 0
+    while i < len(parole):
+        for n in range(min(lunghezza, len(parole) - i), 0, -1):
+            tradotto = glossario.get(tuple(parole[i : i + n]))
+            if tradotto:
+                svuota()
+                risultato.append(tradotto)
+                i += n
+                break
+        else:
+            parola = parole[i]
+            if any(c.isdigit() for c in parola):
+                svuota()
+                risultato.append(parola)
+            elif sconosciute or parola not in PAROLE_VUOTE:
+                sconosciute.append(parola)
+            i += 1
+    svuota()
+
+    tradotto = " ".join(risultato) or parole_chiave
+    if completo:
+        _traduzioni_cache.set(key, tradotto)
+    return tradotto
+
+
+def traduci_parole_chiave(parole_chiave):
+    with EsecutoreContesto(max_workers=2) as ex:
+        fut_de = ex.submit(traduci, parole_chiave, "de")
+        fut_fr = ex.submit(traduci, parole_chiave, "fr")
         de = fut_de.result()
         fr = fut_fr.result()
 
     return {"it": parole_chiave, "de": de, "fr": fr}
 
 
+CSE_ENDPOINT  = os.getenv("CSE_ENDPOINT", "https://www.googleapis.com/customsearch/v1")
+CSE_NUM       = int(os.getenv("CSE_NUM", "5"))
+CSE_CACHE_TTL = int(os.getenv("CSE_CACHE_TTL", str(24 * 3600)))
+LINGUE_RICERCA = ("it", "de", "fr")
+
+_cse_cache = DiskCache("cse", int(os.getenv("CSE_CACHE_MB", "16")) * 1024 * 1024, ttl=CSE_CACHE_TTL)
+
+
+@misura("cse")
 def _cse_query(query):
+    key = f"{CSE_NUM}|{_normalizza_query(query)}"
+    cached = _cse_cache.get(key)
+    if cached is not None:
+        return cached
+    if not (GOOGLE_API_KEY and GOOGLE_CSE_ID):
+        raise ValueError("GOOGLE_API_KEY o GOOGLE_CSE_ID mancanti nel file .env.")
     url = (
-        f"https://www.googleapis.com/customsearch/v1"
+        f"{CSE_ENDPOINT}"
         f"?q={query}+site:bger.ch"
-        f"&key={GOOGLE_API_KEY}&cx={GOOGLE_CSE_ID}"
+        f"&key={GOOGLE_API_KEY}&cx={GOOGLE_CSE_ID}&num={CSE_NUM}"
     )
     try:
-        resp = requests.get(url, timeout=15)
+        resp = http_get(url, timeout=15)
         resp.raise_for_status()
         risultati = []
-        for item in resp.json().get("items", [])[:5]:
+        for item in resp.json().get("items", [])[:CSE_NUM]:
             titolo = item.get("title", "")
             link   = item.get("link", "")
             m = re.search(r"(\d+[A-Z]_\d+/\d+|\d+\s+[IVXLCDM]+\s+\d+)", titolo)
             if m:
                 risultati.append({"codice": m.group(1), "link": link})
-        return risultati
     except Exception:
         return []
+    _cse_cache.set(key, risultati)
+    return risultati
+
+
+def _traduzione(fut):
+    """Result of a traduci future, or None if the translation failed."""
+    try:
+        return fut.result()
+    except Exception:
+        return None
+
+
+def _cse_query_tradotta(fut_traduzione):
+    query = _traduzione(fut_traduzione)
+    return _cse_query(query) if query else []
 
 
-def cerca_sentenze_google(parole_chiave):
-    traduzioni = traduci_parole_chiave(parole_chiave)
-    with ThreadPoolExecutor(max_workers=3) as ex:
-        futures = [ex.submit(_cse_query, q) for q in traduzioni.values()]
-        risultati_finali = []
+def iter_cse_per_lingua(parole_chiave, limite_indice=0):
+    """Yield (lingua, risultati) as soon as each language's search completes.
+
+    With limite_indice the local index is searched first and its hits are
+    yielded with lingua None: the Italian query right away, then again with
+    the DE/FR translations. CSE is only queried if the index leaves slots
+    free; the DE/FR queries then start as soon as their own translation is
+    ready, without waiting for each other.
+    """
+    # Every task may wait on a translation: one worker each so none can starve them.
+    ex = EsecutoreContesto(max_workers=2 * len(LINGUE_RICERCA))
+    try:
+        traduzioni = {l: ex.submit(traduci, parole_chiave, l) for l in LINGUE_RICERCA[1:]}
+        if limite_indice:
+            # Translations keep running meanwhile; CSE quota is only spent on missing slots.
+            trovati = _indice.cerca([parole_chiave], limite_indice)
+            if trovati:
+                yield None, trovati
+            if len(trovati) < limite_indice:
+                trovati = cerca_indice_locale(parole_chiave, limite_indice, traduzioni)
+                yield None, trovati
+            if len(trovati) >= limite_indice:
+                return
+        futures = {ex.submit(_cse_query, parole_chiave): "it"}
+        futures.update({ex.submit(_cse_query_tradotta, traduzioni[l]): l for l in LINGUE_RICERCA[1:]})
         for fut in as_completed(futures):
-            risultati_finali.extend(fut.result())
-    return risultati_finali[:5]
+            yield futures[fut], fut.result()
+    finally:
+        # The consumer may stop early: never block it on the slower languages.
+        ex.shutdown(wait=False, cancel_futures=True)
+
+
+def normalizza_codice(codice):
+    """Canonical form of a decision code: "4a 123/2020" and "4A_123/2020" are the same decision."""
+    codice = re.sub(r"\s+", " ", codice.strip()).upper()
+    return re.sub(r"^(\d+[A-Z])[ _]+(?=\d+/\d+$)", r"\1_", codice)
+
+
+def unisci_risultati_cse(per_lingua):
+    """Merge per-language CSE hits into one deduplicated, deterministic ranking.
+
+    Decisions found by more languages rank first, then by reciprocal rank
+    summed over languages; ties are broken by language order and code.
+    """
+    voci = {}
+    for ordine, lingua in enumerate(LINGUE_RICERCA):
+        for pos, s in enumerate(per_lingua.get(lingua, [])):
+            codice = normalizza_codice(s["codice"])
+            voce = voci.get(codice)
+            if voce is None:
+                voce = voci[codice] = {"sentenza": s, "lingue": set(), "punteggio": 0.0, "ordine": (ordine, pos)}
+            if lingua not in voce["lingue"]:
+                voce["lingue"].add(lingua)
+                voce["punteggio"] += 1.0 / (pos + 1)
+    classifica = sorted(
+        voci.items(),
+        key=lambda kv: (-len(kv[1]["lingue"]), -kv[1]["punteggio"], kv[1]["ordine"], kv[0]),
+    )
+    return [voce["sentenza"] for _, voce in classifica]
+
+
+def cerca_sentenze_google(parole_chiave, limite=5):
+    """Local index hits first; Google CSE tops up the missing results."""
+    risultati, visti, per_lingua = [], set(), {}
+    for lingua, trovati in iter_cse_per_lingua(parole_chiave, limite):
+        if lingua is None:
+            for s in trovati:
+                if len(risultati) < limite and normalizza_codice(s["codice"]) not in visti:
+                    visti.add(normalizza_codice(s["codice"]))
+                    risultati.append(s)
+        else:
+            per_lingua[lingua] = trovati
+    for s in unisci_risultati_cse(per_lingua):
+        if normalizza_codice(s["codice"]) not in visti:
+            risultati.append(s)
+        if len(risultati) >= limite:
+            break
+    return risultati
+
+
+# ── Indice locale full-text delle sentenze già recuperate (SQLite FTS5) ──────
+
+INDICE_MAX_MB         = int(os.getenv("INDICE_MAX_MB", "256"))
+INDICE_PUNTEGGIO_MIN  = float(os.getenv("INDICE_PUNTEGGIO_MIN", "1.0"))  # minimum -bm25 of a local hit
+
+
+class IndiceSentenze(SQLiteStore):
+    """Incremental FTS5 index over fetched BGer decision texts and their summaries.
+
+    Like DiskCache, the stored texts are bounded to max_bytes by evicting the
+    least recently found or indexed decisions.
+    """
+
+    def __init__(self, name: str, max_bytes: int, punteggio_min: float = 0.0):
+        super().__init__(name)
+        self.max_bytes     = max_bytes
+        self.punteggio_min = punteggio_min
+
+    def _crea_schema(self, conn: sqlite3.Connection) -> None:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documenti (
+                id INTEGER PRIMARY KEY, codice TEXT UNIQUE NOT NULL,
+                link TEXT, testo TEXT, sintesi TEXT,
+                size INTEGER NOT NULL DEFAULT 0, accessed REAL NOT NULL DEFAULT 0);
+            CREATE VIRTUAL TABLE IF NOT EXISTS documenti_fts USING fts5(
+                testo, sintesi, content='documenti', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2');
+            CREATE TRIGGER IF NOT EXISTS documenti_ai AFTER INSERT ON documenti BEGIN
+                INSERT INTO documenti_fts(rowid, testo, sintesi) VALUES (new.id, new.testo, new.sintesi);
+            END;
+            CREATE TRIGGER IF NOT EXISTS documenti_ad AFTER DELETE ON documenti BEGIN
+                INSERT INTO documenti_fts(documenti_fts, rowid, testo, sintesi)
+                VALUES ('delete', old.id, old.testo, old.sintesi);
+            END;
+            -- Only text changes reindex: touching size/accessed leaves the FTS table alone.
+            CREATE TRIGGER IF NOT EXISTS documenti_au AFTER UPDATE OF testo, sintesi ON documenti BEGIN
+                INSERT INTO documenti_fts(documenti_fts, rowid, testo, sintesi)
+                VALUES ('delete', old.id, old.testo, old.sintesi);
+                INSERT INTO documenti_fts(rowid, testo, sintesi) VALUES (new.id, new.testo, new.sintesi);
+            END;
+            CREATE INDEX IF NOT EXISTS documenti_accessed ON documenti(accessed);
+        """)
+
+    def aggiungi(self, codice: str, link: str | None = None,
+                 testo: str | None = None, sintesi: str | None = None) -> None:
+        """Insert or update a decision; unchanged texts and known summaries are not reindexed."""
+        codice = normalizza_codice(codice)
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT INTO documenti (codice, link, testo, sintesi) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(codice) DO UPDATE SET "
+                " link = COALESCE(excluded.link, link),"
+                " testo = COALESCE(excluded.testo, testo),"
+                " sintesi = CASE WHEN excluded.sintesi IS NULL THEN sintesi"
+                "   WHEN sintesi IS NULL THEN excluded.sintesi"
+                "   ELSE sintesi || char(10) || excluded.sintesi END "
+                "WHERE (excluded.testo IS NOT NULL AND excluded.testo IS NOT testo)"
+                " OR (excluded.sintesi IS NOT NULL AND instr(COALESCE(sintesi, ''), excluded.sintesi) = 0)",
+                (codice, link, testo, sintesi),
+            )
+            conn.execute(
+                "UPDATE documenti SET accessed = ?, size = length(CAST(COALESCE(testo, '') AS BLOB))"
+                " + length(CAST(COALESCE(sintesi, '') AS BLOB)) WHERE codice = ?",
+                (time.time(), codice),
+            )
+            self._evict(conn)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Drop least recently used decisions until the stored texts fit in max_bytes."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM documenti").fetchone()[0]
+        while total > self.max_bytes:
+            rows = conn.execute("SELECT id, size FROM documenti ORDER BY accessed LIMIT 32").fetchall()
+            if not rows:
+                break
+            vittime = []
+            for id_, size in rows:  # only as many as needed, so the newest entry survives
+                if total <= self.max_bytes:
+                    break
+                vittime.append((id_,))
+                total -= size
+            conn.executemany("DELETE FROM documenti WHERE id = ?", vittime)
+
+    def cerca(self, query_per_lingua, limite: int) -> list:
+        """Best-matching decisions for any of the per-language queries (all terms of one query must match).
+
+        Hits scoring below punteggio_min (-bm25) are dropped, so weak matches
+        leave their slot to Google CSE.
+        """
+        clausole = []
+        for query in query_per_lingua:
+            termini = [t for t in re.findall(r"\w+", query.lower()) if len(t) > 1 and t not in PAROLE_VUOTE]
+            if termini:
+                clausole.append("(" + " ".join(f'"{t}"' for t in termini) + ")")
+        if not clausole:
+            return []
+        try:
+            conn = self._conn()
+            rows = conn.execute(
+                "SELECT d.id, d.codice, d.link, -bm25(documenti_fts, 1.0, 2.0) AS punteggio "
+                "FROM documenti_fts JOIN documenti d ON d.id = documenti_fts.rowid "
+                "WHERE documenti_fts MATCH ? ORDER BY punteggio DESC LIMIT ?",
+                (" OR ".join(dict.fromkeys(clausole)), limite),
+            ).fetchall()
+            rows = [r for r in rows if r[3] >= self.punteggio_min]
+            if rows:
+                conn.executemany("UPDATE documenti SET accessed = ? WHERE id = ?",
+                                 [(time.time(), r[0]) for r in rows])
+        except sqlite3.Error:
+            return []
+        return [{"codice": codice, "link": link} for _, codice, link, _ in rows]
+
+
+_indice = IndiceSentenze("indice_sentenze", INDICE_MAX_MB * 1024 * 1024, INDICE_PUNTEGGIO_MIN)
+
+
+def indicizza_sentenza(codice, testo=None, sintesi=None):
+    """Add a BGer decision to the local index (BVGer texts cannot be served by /ricerca_sentenze)."""
+    if not is_bvger_code(codice):
+        _indice.aggiungi(codice, costruisci_url_bgerli(codice), testo, sintesi)
+
+
+@misura("indice_locale")
+def cerca_indice_locale(parole_chiave, limite=5, traduzioni=None):
+    """Search the local index with the query and its translations (futures, as in iter_cse_per_lingua)."""
+    if traduzioni is None:
+        with EsecutoreContesto(max_workers=len(LINGUE_RICERCA) - 1) as ex:
+            traduzioni = {l: ex.submit(traduci, parole_chiave, l) for l in LINGUE_RICERCA[1:]}
+    query = [parole_chiave] + [q for q in map(_traduzione, traduzioni.values()) if q]
+    return _indice.cerca(query, limite)
+
+
+BGER_LI_BASE = os.getenv("BGER_LI_BASE", "https://bger.li")
+JINA_BASE    = os.getenv("JINA_BASE", "https://r.jina.ai")
 
 
 def costruisci_url_bgerli(codice):
     codice = codice.strip().replace(" ", "-").replace("/", "-")
-    return f"https://bger.li/{codice}"
+    return f"{BGER_LI_BASE}/{codice}"
+
+
+# Raw bger.ch/bger.li pages, shared by /html_federale and the text extraction below.
+# Published decisions do not change, so entries live for a week by default.
+PAGINE_FEDERALI_TTL       = int(os.getenv("PAGINE_FEDERALI_TTL", str(7 * 24 * 3600)))
+PAGINE_FEDERALI_MAX_BYTES = 4 * 1024 * 1024  # larger pages are served but not cached
+HEADERS_FEDERALI = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "it,de,fr,en;q=0.5",
+}
+_pagine_cache = DiskCache("pagine_federali", int(os.getenv("PAGINE_FEDERALI_CACHE_MB", "256")) * 1024 * 1024,
+                          ttl=PAGINE_FEDERALI_TTL)
+_pagine_inflight = SingleFlight()
+
 
+def memorizza_pagina_federale(url: str, url_finale: str, html: str) -> None:
+    if len(html) <= PAGINE_FEDERALI_MAX_BYTES:
+        _pagine_cache.set(url, {"url": url_finale, "html": html})
 
+
+def pagina_federale(url: str) -> dict:
+    """Return {"url": final url, "html": page} for a bger.ch/bger.li page, from cache when possible."""
+    cached = _pagine_cache.get(url)
+    if cached:
+        return cached
+    return _pagine_inflight.do(url, lambda: _scarica_pagina_federale(url))
+
+
+@misura("pagina_federale")
+def _scarica_pagina_federale(url: str) -> dict:
+    resp = http_get(url, timeout=20, headers=HEADERS_FEDERALI, allow_redirects=True)
+    resp.raise_for_status()
+    memorizza_pagina_federale(url, resp.url, resp.text)
+    return {"url": resp.url, "html": resp.text}
+
+
+@misura("parse_sentenza")
+def contenuto_sentenza(html: str):
+    """The decision body (div#content) of a bger page as an lxml element, or None."""
+    try:
+        root = etree.fromstring(html, _HTML_PARSER)
+    except (etree.LxmlError, ValueError):
+        return None
+    if root is None:
+        return None
+    return next((el for el in root.iter("div") if el.get("id") == "content"), None)
+
+
+@misura("testo_sentenza")
 def estrai_testo_sentenza(url):
+    cached = _testi_cache.get(url)
+    if cached:
+        return cached
+    return _testi_inflight.do(url, lambda: _scarica_testo_sentenza(url))
+
+
+def _scarica_testo_sentenza(url):
     try:
-        resp = requests.get(url, timeout=20)
-        resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, "html.parser")
-        content = soup.find("div", id="content")
-        return content.get_text(separator="\n").strip() if content else ""
+        testo = testo_contenuto_sentenza(pagina_federale(url)["html"])
     except Exception as e:
         return f"ERRORE:{e}"
+    if testo:
+        _testi_cache.set(url, testo)
+    return testo
+
+
+def testo_contenuto_sentenza(html: str) -> str:
+    """Text of the decision body (div#content), one text node per line."""
+    content = contenuto_sentenza(html)
+    if content is None:
+        return ""
+    for el in content.iter("script", "style", "template"):
+        el.text = None
+    return "\n".join(content.itertext()).strip()
+
+
+# ── Sezioni delle sentenze (regesto, fatti, considerandi, dispositivo) ────────
+
+# Headings opening each part of a BGer/BVGer decision in DE/FR/IT, on a line of
+# their own in the extracted text. They are only recognized in this order.
+_RE_SEZIONI = (
+    ("regesto", re.compile(r"^Regest[eo](?:\s+[a-z])?\s*:?$", re.I)),
+    ("fatti", re.compile(r"^(?:Sachverhalt|Faits|Fatti|(?:Ritenuto )?in fatto)\s*:?$", re.I)),
+    ("considerandi", re.compile(
+        r"^(?:Erwägungen|(?:Das \S+ zieht )?in Erwägung|Considérant en droit|Considérants|En droit|Droit"
+        r"|Considerando in diritto|Considerandi|(?:In )?diritto)\s*:?$", re.I)),
+    ("dispositivo", re.compile(r"^(?:Demnach (?:erkennt|beschliesst|verfügt)|Par ces motifs|Per questi motivi)\b", re.I)),
+)
+_RE_OGGETTO = re.compile(r"^(?:Gegenstand|Objet|Oggetto)\b", re.I)
+_RE_FIRMA = re.compile(
+    r"^(?:(?:Lausanne|Losanna|Luzern|Lucerne|Lucerna|St\. ?Gallen|Saint-Gall|San Gallo|Bellinzona|Bern|Berne|Berna)"
+    r",\s*(?:le\s+)?\d"
+    r"|Im Namen de|Au nom de|In nome del)", re.I)
+_RE_RIGHE_VUOTE = re.compile(r"\n[ \t]*(?:\n[ \t]*)+")
+# Items of the dispositive part about costs, compensation and notification.
+_RE_PUNTO_ACCESSORIO = re.compile(
+    r"Gerichtskosten|Verfahrenskosten|Parteientschädigung|zu entschädigen|mitgeteilt"
+    r"|frais judiciaires|frais de procédure|dépens|communiqué"
+    r"|spese giudiziarie|ripetibili|comunica(?:t[oa]|zione)", re.I)
+
+
+def sezioni_sentenza(testo: str) -> dict:
+    """Split a decision's text into {sezione: testo}, keeping each section's own heading.
+
+    Sections: intestazione (court, panel, parties), oggetto (subject and appealed
+    decision), regesto, fatti, considerandi, dispositivo, firma. A heading quoted
+    later in the text cannot reopen an earlier section, and the dispositive part
+    is only recognized right after the considerations.
+    """
+    sezioni  = {"intestazione": []}
+    corrente = "intestazione"
+    livello  = -1
+    for riga in testo.splitlines():
+        chiave = riga.strip().strip("*#_ ")
+        if chiave and corrente != "firma":
+            for i in range(livello + 1, len(_RE_SEZIONI)):
+                nome, regex = _RE_SEZIONI[i]
+                if regex.match(chiave) and (nome != "dispositivo" or corrente == "considerandi"):
+                    corrente, livello = nome, i
+                    break
+            else:
+                if corrente == "intestazione" and _RE_OGGETTO.match(chiave):
+                    corrente = "oggetto"
+                elif corrente == "dispositivo" and _RE_FIRMA.match(chiave):
+                    corrente = "firma"
+        sezioni.setdefault(corrente, []).append(riga)
+    # Runs of blank lines (one per whitespace node of the page) become a single one.
+    return {nome: testo for nome, righe in sezioni.items()
+            if (testo := _RE_RIGHE_VUOTE.sub("\n\n", "\n".join(righe)).strip())}
+
+
+def dispositivo_essenziale(dispositivo: str) -> str:
+    """The dispositive part without its cost, compensation and notification items."""
+    punti = [[]]
+    for riga in dispositivo.splitlines():
+        if re.match(r"\s*\d+\.", riga) and punti[-1]:
+            punti.append([])
+        punti[-1].append(riga)
+    # punti[0] is the heading, punti[1] the outcome: both always stay.
+    tenuti = [p for i, p in enumerate(punti) if i < 2 or not _RE_PUNTO_ACCESSORIO.search(" ".join(p))]
+    return "\n".join(riga for p in tenuti for riga in p).strip()
 
 def is_bvger_code(codice):
     return bool(re.match(r'^[A-Z]-\d+/\d{4}$', codice.strip()))
 
+UUID_BVGER_NEG_TTL = int(os.getenv("UUID_BVGER_NEG_TTL", str(24 * 3600)))
+
+
+class MappaUuidBvger(SQLiteStore):
+    """Durable BVGer code -> weblaw UUID map; misses are remembered for UUID_BVGER_NEG_TTL."""
+
+    def _crea_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS uuid_bvger ("
+            " codice TEXT PRIMARY KEY, uuid TEXT, aggiornato REAL NOT NULL)"
+        )
+
+    def cerca(self, codice: str) -> tuple:
+        """Return (trovato, uuid): trovato is False when the code must be looked up remotely."""
+        try:
+            row = self._conn().execute(
+                "SELECT uuid, aggiornato FROM uuid_bvger WHERE codice = ?", (codice,)
+            ).fetchone()
+        except sqlite3.Error:
+            return False, None
+        if row is None:
+            return False, None
+        uuid, aggiornato = row
+        if uuid is None and time.time() - aggiornato > UUID_BVGER_NEG_TTL:
+            return False, None
+        return True, uuid
+
+    def salva(self, codice: str, uuid: str | None) -> None:
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO uuid_bvger (codice, uuid, aggiornato) VALUES (?, ?, ?)",
+                (codice, uuid, time.time()),
+            )
+        except sqlite3.Error:
+            pass
+
+
+_uuid_bvger = MappaUuidBvger("uuid_bvger")
+_uuid_bvger_inflight = SingleFlight()
+
+
+@misura("uuid_bvger")
+def _cerca_uuid_bvger_remoto(codice):
+    """Scrape the UUID via DuckDuckGo/jina; raises on network errors so they are not cached as misses."""
+    q = requests.utils.quote(codice + " site:bvger.weblaw.ch")
+    resp = http_get(
+        f"{JINA_BASE}/https://duckduckgo.com/html/?q={q}",
+        headers={"Accept": "text/plain"}, timeout=30)
+    resp.raise_for_status()
+    m = re.search(r'([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})', resp.text)
+    return m.group(1) if m else None
+
+
 def cerca_uuid_bvger(codice):
-    try:
-        q = requests.utils.quote(codice + " site:bvger.weblaw.ch")
-        resp = requests.get(
-            f"https://r.jina.ai/https://duckduckgo.com/html/?q={q}",
-            headers={"Accept": "text/plain"}, timeout=30)
-        m = re.search(r'([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})', resp.text)
-        return m.group(1) if m else None
-    except Exception:
-        return None
+    codice = codice.strip().upper()
+    trovato, uuid = _uuid_bvger.cerca(codice)
+    if trovato:
+        return uuid
 
+    def risolvi():
+        try:
+            uuid = _cerca_uuid_bvger_remoto(codice)
+        except Exception:
+            return None
+        _uuid_bvger.salva(codice, uuid)
+        return uuid
+
+    return _uuid_bvger_inflight.do(codice, risolvi)
+
+
+def risolvi_uuid_bvger_batch(codici, concorrenza=4):
+    """Resolve many BVGer codes concurrently, filling the durable map. Returns {codice: uuid}."""
+    codici = list(dict.fromkeys(c.strip().upper() for c in codici if is_bvger_code(c.strip().upper())))
+    with ThreadPoolExecutor(max_workers=max(1, concorrenza)) as ex:
+        return dict(zip(codici, ex.map(cerca_uuid_bvger, codici)))
+
+@misura("testo_bvger")
 def estrai_testo_bvger(uuid):
+    cache_url = f"https://bvger.weblaw.ch/cache?guiLanguage=it&id={uuid}"
+    cached = _testi_cache.get(cache_url)
+    if cached:
+        return cached
     try:
-        cache_url = f"https://bvger.weblaw.ch/cache?guiLanguage=it&id={uuid}"
-        resp = requests.get(f"https://r.jina.ai/{cache_url}",
+        resp = http_get(f"{JINA_BASE}/{cache_url}",
             headers={"Accept": "text/plain"}, timeout=30)
-        return resp.text.strip() if len(resp.text) > 200 else ""
+        testo = resp.text.strip() if len(resp.text) > 200 else ""
     except Exception as e:
         return f"ERRORE:{e}"
+    if testo:
+        _testi_cache.set(cache_url, testo)
+    return testo
 
 
+def recupera_testo_sentenza(codice: str) -> tuple:
+    """(testo, errore) for a BGer or BVGer decision code."""
+    if is_bvger_code(codice):
+        uuid = cerca_uuid_bvger(codice)
+        if not uuid:
+            return None, "Sentenza BVGer non trovata su weblaw.ch."
+        testo = estrai_testo_bvger(uuid)
+    else:
+        url   = costruisci_url_bgerli(codice)
+        testo = estrai_testo_sentenza(url)
+
+    if not testo or testo.startswith("ERRORE") or len(testo) < 100:
+        return None, "Impossibile recuperare il testo della sentenza."
+    return testo, None
+
+
+# ── Token: encoder unico per processo, tokenizzazione una sola volta per documento ──
+
+TOKEN_MODEL     = "gpt-4o"
+TOKEN_MEMO_DOCS = int(os.getenv("TOKEN_MEMO_DOCS", "32"))
+
+_encoder = None
+_encoder_lock = threading.Lock()
+_token_memo: OrderedDict = OrderedDict()
+_token_memo_lock = threading.Lock()
+
+
+def encoder():
+    """Return the tiktoken encoder, loading it once per process."""
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                import tiktoken
+                _encoder = tiktoken.encoding_for_model(TOKEN_MODEL)
+    return _encoder
+
+
+@misura("tokenizzazione")
+def token_per_riga(testo: str) -> tuple:
+    """Return (righe, tokens of each riga) for testo, encoding each document only once.
+
+    Results are kept in a small per-process LRU keyed by content hash, so
+    truncation and chunking of the same judgment share one tokenization.
+    """
+    key = hashlib.sha1(testo.encode("utf-8")).digest()
+    with _token_memo_lock:
+        memo = _token_memo.get(key)
+        if memo is not None:
+            _token_memo.move_to_end(key)
+            return memo
+    righe = testo.split("\n")
+    memo  = (righe, encoder().encode_ordinary_batch(righe))
+    with _token_memo_lock:
+        _token_memo[key] = memo
+        while len(_token_memo) > TOKEN_MEMO_DOCS:
+            _token_memo.popitem(last=False)
+    return memo
+
+
+def _token_memo_cerca(testo: str):
+    key = hashlib.sha1(testo.encode("utf-8")).digest()
+    with _token_memo_lock:
+        return _token_memo.get(key)
+
+
+def tronca_token(testo: str, max_tokens: int) -> str:
+    """Return the prefix of testo that fits in max_tokens."""
+    return tronca_token_contati(testo, max_tokens)[0]
+
+
+@misura("tokenizzazione")
+def tronca_token_contati(testo: str, max_tokens: int) -> tuple:
+    """Return (prefix of testo that fits in max_tokens, its token count).
+
+    Only a growing character prefix is encoded, so megabyte texts are never
+    tokenized in full; an existing tokenization from token_per_riga is reused.
+    """
+    enc  = encoder()
+    memo = _token_memo_cerca(testo)
+    if memo is not None:
+        righe, tokens = memo
+        parti, n = [], 0
+        for riga, tok in zip(righe, tokens):
+            a_capo = 1 if parti else 0  # the newline joining riga to the previous line
+            if n + a_capo + len(tok) > max_tokens:
+                resto = max(0, max_tokens - n - a_capo)
+                if resto:
+                    parti.append(enc.decode(tok[:resto]))
+                    n += a_capo + resto
+                return "\n".join(parti), n
+            parti.append(riga)
+            n += a_capo + len(tok)
+        return testo, n
+
+    n_char = max_tokens * 6
+    while True:
+        tok = enc.encode_ordinary(testo[:n_char])
+        if len(tok) > max_tokens:
+            return enc.decode(tok[:max_tokens]), max_tokens
+        if n_char >= len(testo):
+            return testo, len(tok)
+        n_char *= 2
+
+
+CHUNK_FANOUT = int(os.getenv("CHUNK_FANOUT", "4"))
+
+# Start of a consideration ("3.", "3.2", "E. 4.1", "consid. 5") or a blank line between paragraphs.
+_CONFINE_PARAGRAFO = re.compile(r"^\s*(?:$|(?:E\.|consid\.|cons\.)?\s*\d+(?:\.\d+)*\.?\s)")
+
+
+@misura("chunking")
 def split_in_chunks(text, max_tokens=12000):
-    enc    = tiktoken.encoding_for_model("gpt-4o")
-    tokens = enc.encode(text)
-    if len(tokens) <= max_tokens:
+    """Split text into chunks of at most max_tokens, cutting at line boundaries.
+
+    Once a chunk is 80% full it is closed at the next paragraph or consideration
+    boundary, so considerations are not cut in the middle; only single lines
+    longer than max_tokens are split at raw token offsets.
+    """
+    enc = encoder()
+    righe, tokens = token_per_riga(text)
+    if sum(len(t) + 1 for t in tokens) <= max_tokens:
         return [text]
-    chunks = []
-    for i in range(0, len(tokens), max_tokens):
-        chunks.append(enc.decode(tokens[i : i + max_tokens]))
-    return chunks
-
-
-def chiama_openai(system: str, user: str, max_tokens: int = 1200) -> str:
-    resp = client.chat.completions.create(
-        model=MODEL,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user",   "content": user},
-        ],
-        max_tokens=max_tokens,
-        temperature=0.2,
-    )
+
+    chunks, corrente, n = [], [], 0
+    soglia = int(max_tokens * 0.8)
+    for riga, tok in zip(righe, tokens):
+        k = len(tok) + 1
+        if k > max_tokens:
+            if corrente:
+                chunks.append("\n".join(corrente))
+                corrente, n = [], 0
+            for i in range(0, len(tok), max_tokens):
+                chunks.append(enc.decode(tok[i : i + max_tokens]))
+            continue
+        if corrente and (n + k > max_tokens or (n >= soglia and _CONFINE_PARAGRAFO.match(riga))):
+            chunks.append("\n".join(corrente))
+            corrente, n = [], 0
+        corrente.append(riga)
+        n += k
+    if corrente:
+        chunks.append("\n".join(corrente))
+    return [c for c in chunks if c.strip()]
+
+
+# ── Ammissione delle chiamate LLM (budget RPM/TPM condiviso tra i worker, priorità) ──
+
+LLM_RPM          = int(os.getenv("LLM_RPM", "500"))
+LLM_TPM          = int(os.getenv("LLM_TPM", "200000"))
+LLM_ATTESA_MAX   = float(os.getenv("LLM_ATTESA_MAX", "120"))
+LLM_CODA_MAX     = int(os.getenv("LLM_CODA_MAX", "40"))  # waiting calls beyond which requests are shed
+
+PRIORITA_INTERATTIVA = 0  # /sintesi
+PRIORITA_BATCH       = 1  # /ricerca_sentenze fan-out
+PRIORITA_FONDO       = 2  # background jobs
+
+
+class BudgetLLMEsaurito(TimeoutError):
+    """An OpenAI call waited LLM_ATTESA_MAX without fitting in the budget: the caller should shed load."""
+
+
+class SchedulerLLM(SQLiteStore):
+    """Admit OpenAI calls within LLM_RPM/LLM_TPM over a sliding minute, across all workers.
+
+    Calls that do not fit wait in a per-process priority queue; only the head of
+    the queue competes for the shared budget, and it also yields while another
+    worker has higher-priority calls waiting. Each worker publishes its queue
+    lengths so that profondita() sees the whole deployment.
+    """
+
+    FINESTRA = 60.0
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._cond   = threading.Condition()
+        self._attesa: list = []  # heap of (priorita, seq)
+        self._seq    = itertools.count()
+        self._pubblica_lock = threading.Lock()
+
+    def _crea_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS consumi ("
+            " id INTEGER PRIMARY KEY, ts REAL NOT NULL, token INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS consumi_ts ON consumi(ts)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS code ("
+            " pid INTEGER NOT NULL, priorita INTEGER NOT NULL, in_coda INTEGER NOT NULL,"
+            " aggiornato REAL NOT NULL, PRIMARY KEY (pid, priorita))"
+        )
+
+    def _prova(self, token: int) -> tuple:
+        """Try to book token in the current window: (id, 0) if admitted, else (None, seconds to wait)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            conn.execute("DELETE FROM consumi WHERE ts < ?", (now - self.FINESTRA,))
+            n, usati = conn.execute("SELECT COUNT(*), COALESCE(SUM(token), 0) FROM consumi").fetchone()
+            # A call larger than the whole budget is let through alone rather than starved.
+            if n < LLM_RPM and (usati + token <= LLM_TPM or n == 0):
+                id_ = conn.execute("INSERT INTO consumi (ts, token) VALUES (?, ?)", (now, token)).lastrowid
+                conn.execute("COMMIT")
+                return id_, 0.0
+            attesa = self.FINESTRA
+            liberati = 0
+            for ts, t in conn.execute("SELECT ts, token FROM consumi ORDER BY ts"):
+                liberati += t
+                n -= 1
+                if n < LLM_RPM and usati - liberati + token <= LLM_TPM:
+                    attesa = ts + self.FINESTRA - now
+                    break
+            conn.execute("COMMIT")
+            return None, max(attesa, 0.05)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def correggi(self, id_: int, token: int) -> None:
+        """Replace the estimate booked for an admitted call with the tokens it actually used."""
+        try:
+            self._conn().execute("UPDATE consumi SET token = ? WHERE id = ?", (token, id_))
+        except sqlite3.Error:
+            pass
+
+    def _pubblica(self) -> None:
+        with self._pubblica_lock:  # so that an older count never overwrites a newer one
+            with self._cond:
+                conteggi = [0, 0, 0]
+                for priorita, _ in self._attesa:
+                    conteggi[priorita] += 1
+            try:
+                self._conn().executemany(
+                    "INSERT OR REPLACE INTO code (pid, priorita, in_coda, aggiornato) VALUES (?, ?, ?, ?)",
+                    [(os.getpid(), p, c, time.time()) for p, c in enumerate(conteggi)],
+                )
+            except sqlite3.Error:
+                pass
+
+    def _precedenza_altrove(self, priorita: int) -> bool:
+        try:
+            (n,) = self._conn().execute(
+                "SELECT COALESCE(SUM(in_coda), 0) FROM code WHERE priorita < ? AND pid != ? AND aggiornato > ?",
+                (priorita, os.getpid(), time.time() - 10),
+            ).fetchone()
+        except sqlite3.Error:
+            return False
+        return n > 0
+
+    def consumo(self) -> tuple:
+        """(calls, tokens) booked in the current window by all workers."""
+        try:
+            return tuple(self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(token), 0) FROM consumi WHERE ts >= ?",
+                (time.time() - self.FINESTRA,),
+            ).fetchone())
+        except sqlite3.Error:
+            return 0, 0
+
+    def profondita(self) -> dict:
+        """Waiting calls per priority, summed over the workers seen in the last 10 seconds."""
+        try:
+            righe = self._conn().execute(
+                "SELECT priorita, SUM(in_coda) FROM code WHERE aggiornato > ? GROUP BY priorita",
+                (time.time() - 10,),
+            ).fetchall()
+        except sqlite3.Error:
+            righe = []
+        return {p: n for p, n in righe}
+
+    @misura("coda_llm")
+    def acquisisci(self, token: int, priorita: int) -> int | None:
+        """Block until the call may proceed; returns the booking id (None when budgeting is off)."""
+        if LLM_RPM <= 0 or LLM_TPM <= 0:
+            return None
+        voce = (priorita, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._attesa, voce)
+            self._cond.notify_all()  # a waiting head we overtake steps back
+        self._pubblica()
+        scadenza = time.monotonic() + LLM_ATTESA_MAX
+        try:
+            while True:
+                with self._cond:
+                    while self._attesa[0] != voce:
+                        if not self._cond.wait(timeout=max(0.0, scadenza - time.monotonic())):
+                            raise BudgetLLMEsaurito("Budget OpenAI esaurito: coda troppo lunga")
+                if priorita > PRIORITA_INTERATTIVA and self._precedenza_altrove(priorita):
+                    attesa = 0.2
+                else:
+                    try:
+                        id_, attesa = self._prova(token)
+                    except sqlite3.Error:
+                        return None  # budget store unavailable: do not block the call
+                    if id_ is not None:
+                        return id_
+                if time.monotonic() + attesa > scadenza:
+                    raise BudgetLLMEsaurito("Budget OpenAI esaurito: coda troppo lunga")
+                self._pubblica()
+                with self._cond:
+                    # Wake up early if a higher-priority call overtakes us.
+                    self._cond.wait(timeout=min(attesa, 1.0))
+        finally:
+            with self._cond:
+                self._attesa.remove(voce)
+                heapq.heapify(self._attesa)
+                self._cond.notify_all()
+            self._pubblica()
+
+
+_scheduler_llm = SchedulerLLM("scheduler_llm")
+
+
+def coda_llm_piena(priorita: int) -> bool:
+    """True when calls at priorita (or more urgent) already waiting exceed LLM_CODA_MAX."""
+    profondita = _scheduler_llm.profondita()
+    return sum(n for p, n in profondita.items() if p <= priorita) >= LLM_CODA_MAX
+
+
+def risposta_sovraccarico():
+    return jsonify({"errore": "Servizio momentaneamente sovraccarico, riprova tra poco."}), 503, {"Retry-After": "30"}
+
+
+# Admission only needs an upper-ish bound: the booking is corrected with the real usage
+# afterwards, so prompts are not tokenized a second time just to reserve budget.
+CARATTERI_PER_TOKEN = 3
+
+
+def stima_token(testo: str) -> int:
+    """Cheap overestimate of the token count of testo (legal DE/FR/IT text runs ~3.5-4 chars per token)."""
+    return -(-len(testo) // CARATTERI_PER_TOKEN)
+
+
+def chiama_openai(system: str, user: str, max_tokens: int = 1200,
+                  priorita: int = PRIORITA_INTERATTIVA, token_prompt: int | None = None) -> str:
+    """One chat completion; token_prompt defaults to a length-based estimate."""
+    if token_prompt is None:
+        token_prompt = stima_token(system) + stima_token(user)
+    prenotazione = _scheduler_llm.acquisisci(token_prompt + max_tokens, priorita)
+    with fase("openai"):
+        resp = client_openai().chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user",   "content": user},
+            ],
+            max_tokens=max_tokens,
+            temperature=0.2,
+        )
+    if resp.usage:
+        _metriche.incrementa("sententia_llm_token_totale", resp.usage.prompt_tokens, tipo="prompt")
+        _metriche.incrementa("sententia_llm_token_totale", resp.usage.completion_tokens, tipo="completion")
+        if prenotazione is not None:
+            _scheduler_llm.correggi(prenotazione, resp.usage.total_tokens)
     return resp.choices[0].message.content.strip()
 
 
-def riassumi_con_chunking(testo: str, fn_call) -> str:
+def chiama_openai_stream(system: str, user: str, max_tokens: int = 1200,
+                         priorita: int = PRIORITA_INTERATTIVA, token_prompt: int | None = None):
+    """Like chiama_openai, but yield the completion as token deltas while they arrive."""
+    if token_prompt is None:
+        token_prompt = stima_token(system) + stima_token(user)
+    prenotazione = _scheduler_llm.acquisisci(token_prompt + max_tokens, priorita)
+    generato, usage = [], None
+    with fase("openai"):
+        stream = client_openai().chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user",   "content": user},
+            ],
+            max_tokens=max_tokens,
+            temperature=0.2,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                generato.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+    if usage:
+        token_prompt, token_risposta = usage.prompt_tokens, usage.completion_tokens
+    else:
+        token_risposta = stima_token("".join(generato))
+    _metriche.incrementa("sententia_llm_token_totale", token_prompt, tipo="prompt")
+    _metriche.incrementa("sententia_llm_token_totale", token_risposta, tipo="completion")
+    if prenotazione is not None:
+        _scheduler_llm.correggi(prenotazione, token_prompt + token_risposta)
+
+
+def riassumi_con_chunking(testo: str, fn_call, fn_finale=None):
+    """Hierarchical map-reduce summary; fn_finale (default fn_call) produces the final result.
+
+    Chunks are summarized concurrently (at most CHUNK_FANOUT at a time). If the
+    joined partial summaries still exceed one chunk, they are regrouped and
+    reduced again, so latency grows with tree depth rather than chunk count.
+    """
+    fn_finale = fn_finale or fn_call
     chunks = split_in_chunks(testo)
     if len(chunks) == 1:
-        return fn_call(testo)
-    parziali = [fn_call(c) for c in chunks]
-    return fn_call("\n\n".join(parziali))
+        return fn_finale(testo)
+    with EsecutoreContesto(max_workers=min(CHUNK_FANOUT, len(chunks))) as ex:
+        while len(chunks) > 1:
+            parziali = list(ex.map(fn_call, chunks))
+            testo    = "\n\n".join(parziali)
+            chunks   = split_in_chunks(testo)
+    return fn_finale(testo)
+
+
+# Summaries get the sections their prompts need instead of the whole page text.
+SINTESI_PER_SEZIONI = os.getenv("SINTESI_PER_SEZIONI", "1") != "0"
+RICERCA_MAX_TOKEN   = int(os.getenv("RICERCA_MAX_TOKEN", "4000"))  # sectioned input; whole texts keep 6000
+
+# Order in which a token budget is handed out; the text is sent in document order.
+_PRIORITA_SEZIONI = ("oggetto", "regesto", "dispositivo", "fatti", "considerandi")
+_ORDINE_SEZIONI   = ("oggetto", "regesto", "fatti", "considerandi", "dispositivo")
+
+
+def testo_per_sintesi(testo: str, max_tokens: int | None = None) -> str | None:
+    """The parts of a decision a summary prompt needs, or None if it cannot be segmented.
+
+    Header, signature and the cost and notification items of the dispositive
+    part are dropped. With max_tokens, the other sections are kept whole where
+    possible (fatti at most half the budget) and the considerations fill what
+    is left, so truncation never cuts away the outcome.
+    """
+    sezioni = sezioni_sentenza(testo) if SINTESI_PER_SEZIONI else {}
+    if "considerandi" not in sezioni:
+        _metriche.incrementa("sententia_sezioni_totale", esito="intera")
+        return None
+    _metriche.incrementa("sententia_sezioni_totale", esito="sezioni")
+    if "dispositivo" in sezioni:
+        sezioni["dispositivo"] = dispositivo_essenziale(sezioni["dispositivo"])
+    if max_tokens:
+        resto = max_tokens
+        for nome in _PRIORITA_SEZIONI:
+            if nome not in sezioni:
+                continue
+            quota = min(resto, max_tokens // 2 if nome == "fatti" else resto)
+            sezioni[nome], n = tronca_token_contati(sezioni[nome], quota) if quota > 0 else ("", 0)
+            resto -= n + 2
+    return "\n\n".join(sezioni[n] for n in _ORDINE_SEZIONI if sezioni.get(n))
 
 
 # Ã¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂ Smart Search: sintesi compatta (~10 righe) Ã¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂ
@@ -205,18 +1743,16 @@ PROMPT_SEARCH = {
 }
 
 
-def sintetizza_sentenza_10_righe(testo: str, lang: str = "it") -> str:
+def sintetizza_sentenza_10_righe(testo: str, lang: str = "it", priorita: int = PRIORITA_BATCH) -> str:
     l = lang if lang in PROMPT_SEARCH else "it"
-    enc = tiktoken.encoding_for_model("gpt-4o")
-    tokens = enc.encode(testo)
-    if len(tokens) > 6000:
-        testo = enc.decode(tokens[:6000])
+    testo = testo_per_sintesi(testo, RICERCA_MAX_TOKEN) or tronca_token(testo, 6000)
 
     def call(t):
         return chiama_openai(
             system=SYSTEM_SEARCH[l],
             user=PROMPT_SEARCH[l].format(testo=t),
             max_tokens=550,
+            priorita=priorita,
         )
 
     return call(testo)
@@ -288,86 +1824,357 @@ PROMPT_SUMM = {
 }
 
 
-def sintetizza_testo_sentenza_4_punti(testo: str, lang: str = "it") -> str:
+def sintetizza_testo_sentenza_4_punti(testo: str, lang: str = "it",
+                                      priorita: int = PRIORITA_INTERATTIVA) -> str:
     l = lang if lang in PROMPT_SUMM else "it"
+    testo = testo_per_sintesi(testo) or testo
 
     def call(t):
         return chiama_openai(
             system=SYSTEM_SUMM[l],
             user=PROMPT_SUMM[l].format(testo=t),
             max_tokens=950,
+            priorita=priorita,
         )
 
     return riassumi_con_chunking(testo, call)
 
 
+def sintetizza_testo_sentenza_4_punti_stream(testo: str, lang: str = "it"):
+    """Streaming variant of sintetizza_testo_sentenza_4_punti: yield deltas of the final completion."""
+    l = lang if lang in PROMPT_SUMM else "it"
+    testo = testo_per_sintesi(testo) or testo
+
+    def call(t):
+        return chiama_openai(
+            system=SYSTEM_SUMM[l],
+            user=PROMPT_SUMM[l].format(testo=t),
+            max_tokens=950,
+        )
+
+    def call_stream(t):
+        return chiama_openai_stream(
+            system=SYSTEM_SUMM[l],
+            user=PROMPT_SUMM[l].format(testo=t),
+            max_tokens=950,
+        )
+
+    return riassumi_con_chunking(testo, call, call_stream)
+
+
+# ── Cache delle sintesi + deduplicazione delle richieste concorrenti ──────────
+
+# Version of the input pipeline (text extraction, sections, token budgets) feeding the
+# prompts: bump it whenever the text a prompt receives changes for the same decision.
+VERSIONE_INPUT_SINTESI = 2
+
+
+def _versione_prompt(system: str, prompt: str, *pipeline) -> str:
+    parti = (system, prompt, str(VERSIONE_INPUT_SINTESI), *map(str, pipeline))
+    return hashlib.sha1("\x00".join(parti).encode("utf-8")).hexdigest()[:12]
+
+
+# Any edit to a system prompt, a template or the input settings changes its version,
+# so stale summaries are never served.
+VERSIONI_PROMPT = {
+    "ricerca": {l: _versione_prompt(SYSTEM_SEARCH[l], PROMPT_SEARCH[l], SINTESI_PER_SEZIONI, RICERCA_MAX_TOKEN)
+                for l in PROMPT_SEARCH},
+    "sintesi": {l: _versione_prompt(SYSTEM_SUMM[l], PROMPT_SUMM[l], SINTESI_PER_SEZIONI) for l in PROMPT_SUMM},
+}
+
+_sintesi_cache = DiskCache("sintesi", int(os.getenv("SINTESI_CACHE_MB", "128")) * 1024 * 1024)
+_sintesi_inflight = SingleFlight()
+
+
+def chiave_sintesi(tipo: str, codice: str, lang: str) -> str:
+    """Cache key (tipo, codice, lang, prompt version, model) for a summary."""
+    versioni = VERSIONI_PROMPT[tipo]
+    l = lang if lang in versioni else "it"
+    return f"{tipo}|{normalizza_codice(codice)}|{l}|{versioni[l]}|{MODEL}"
+
+
+def sintesi_con_cache(tipo: str, codice: str, lang: str, calcola) -> tuple:
+    """Return (sintesi, errore) for a decision, computing it at most once per key.
+
+    calcola() must return the same (sintesi, errore) pair; only successful
+    summaries are cached.
+    """
+    key = chiave_sintesi(tipo, codice, lang)
+
+    cached = _sintesi_cache.get(key)
+    if cached:
+        return cached, None
+
+    def _calcola():
+        # Another worker may have finished while we were waiting on the lock.
+        cached = _sintesi_cache.get(key)
+        if cached:
+            return cached, None
+        sintesi, errore = calcola()
+        if sintesi:
+            _sintesi_cache.set(key, sintesi)
+        return sintesi, errore
+
+    return _sintesi_inflight.do(key, _calcola)
+
+
 # Ã¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂ Endpoints Ã¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂ
 
-@app.route("/ricerca_sentenze", methods=["GET"])
+@bp.route("/ricerca_sentenze", methods=["GET"])
 @limiter.limit("5 per minute; 30 per day")
 def ricerca_sentenze():
     query = request.args.get("query", "").strip()
     lang  = request.args.get("lang", "it")
     if not query:
         return jsonify({"errore": "Parametro 'query' mancante"}), 400
-
-    sentenze = cerca_sentenze_google(query)
+    if coda_llm_piena(PRIORITA_BATCH):
+        return risposta_sovraccarico()
 
     def processa(s):
-        url   = costruisci_url_bgerli(s["codice"])
-        testo = estrai_testo_sentenza(url)
-        if not testo or testo.startswith("ERRORE") or len(testo) < 100:
-            sintesi = "Impossibile recuperare il testo della sentenza."
-        else:
-            sintesi = sintetizza_sentenza_10_righe(testo, lang)
-        return {"titolo": s["codice"], "riassunto": sintesi, "link": url}
-
-    with ThreadPoolExecutor(max_workers=5) as ex:
-        futures = {ex.submit(processa, s): i for i, s in enumerate(sentenze)}
-        risultati = [None] * len(sentenze)
-        for fut in as_completed(futures):
-            risultati[futures[fut]] = fut.result()
+        url = costruisci_url_bgerli(s["codice"])
 
-    return jsonify([r for r in risultati if r is not None])
+        def calcola():
+            testo = estrai_testo_sentenza(url)
+            if not testo or testo.startswith("ERRORE") or len(testo) < 100:
+                return None, "Impossibile recuperare il testo della sentenza."
+            sintesi = sintetizza_sentenza_10_righe(testo, lang)
+            indicizza_sentenza(s["codice"], testo, sintesi)
+            return sintesi, None
+
+        sintesi, errore = sintesi_con_cache("ricerca", s["codice"], lang, calcola)
+        return {"titolo": s["codice"], "riassunto": sintesi or errore, "link": url}
+
+    if request.args.get("stream") in ("1", "true"):
+        def genera():
+            for _, fut in pipeline_ricerca(query, processa):
+                try:
+                    riga = fut.result()
+                except Exception:
+                    continue
+                if riga is not None:
+                    yield json.dumps(riga, ensure_ascii=False) + "\n"
+
+        return Response(stream_with_context(genera()), mimetype="application/x-ndjson")
+
+    # One failed or shed summary drops its result, not the whole list.
+    risultati, sovraccarico = [], False
+    for _, fut in sorted(pipeline_ricerca(query, processa), key=lambda x: x[0]):
+        try:
+            riga = fut.result()
+        except BudgetLLMEsaurito:
+            sovraccarico = True
+            continue
+        except Exception:
+            continue
+        if riga is not None:
+            risultati.append(riga)
+    if not risultati and sovraccarico:
+        return risposta_sovraccarico()
+    return jsonify(risultati)
+
+
+PREFETCH_TESTI = int(os.getenv("PREFETCH_TESTI", "3"))  # concurrent text prefetches per search
+
+
+def pipeline_ricerca(query, processa, limite=5):
+    """Yield (indice, future) for processa(s) in completion order.
+
+    Local index hits go to processa as soon as they arrive; the per-language
+    CSE queries only run for the slots they leave. While CSE results come in, the
+    texts of the decisions currently ranked in the remaining slots are
+    prefetched; once all languages are in, the deterministic top results fill
+    those slots.
+    The search runs in a feeder thread so results can be consumed meanwhile.
+    """
+    completati = queue.Queue()
+
+    def alimenta():
+        # Prefetches run on their own small pool so processa never queues behind
+        # them; the ones not started yet are dropped once the slots are filled.
+        prefetch = EsecutoreContesto(max_workers=PREFETCH_TESTI)
+        try:
+            with EsecutoreContesto(max_workers=5) as ex:
+                inviati = []
+
+                def invia(s):
+                    fut = ex.submit(processa, s)
+                    fut.add_done_callback(lambda f, i=len(inviati): completati.put((i, f)))
+                    inviati.append(normalizza_codice(s["codice"]))
+
+                per_lingua = {}
+                prefetch_inviati = set()
+                for lingua, risultati in iter_cse_per_lingua(query, limite):
+                    if lingua is None:
+                        # Decisions already in the local index start immediately; CSE only tops up.
+                        for s in risultati:
+                            if len(inviati) < limite and normalizza_codice(s["codice"]) not in inviati:
+                                invia(s)
+                        if len(inviati) >= limite:
+                            break
+                    else:
+                        per_lingua[lingua] = risultati
+                    candidati = [s for s in unisci_risultati_cse(per_lingua)
+                                 if normalizza_codice(s["codice"]) not in inviati][: limite - len(inviati)]
+                    for s in candidati:
+                        codice = normalizza_codice(s["codice"])
+                        if codice not in prefetch_inviati:
+                            prefetch_inviati.add(codice)
+                            prefetch.submit(estrai_testo_sentenza, costruisci_url_bgerli(s["codice"]))
+                else:
+                    for s in unisci_risultati_cse(per_lingua):
+                        if len(inviati) >= limite:
+                            break
+                        if normalizza_codice(s["codice"]) not in inviati:
+                            invia(s)
+                # Running prefetches finish in the background (their text is cached and
+                # shared with processa through _testi_inflight); nobody waits for them.
+                prefetch.shutdown(wait=False, cancel_futures=True)
+        finally:
+            prefetch.shutdown(wait=False, cancel_futures=True)
+            completati.put(None)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(alimenta,), daemon=True).start()
+    while (item := completati.get()) is not None:
+        yield item
 
 
 # Ã¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂ Law text retrieval via Fedlex SPARQL + public filestore Ã¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂÃ¢ÂÂÃÂÃÂ¶Ã¢ÂÂÃÂÃ¢ÂÂÃÂ
 
-SPARQL_ENDPOINT  = "https://fedlex.data.admin.ch/sparqlendpoint"
+SPARQL_ENDPOINT  = os.getenv("SPARQL_ENDPOINT", "https://fedlex.data.admin.ch/sparqlendpoint")
 PRIVATE_FILESTORE = "https://intranet.fedlex.admin.ch/casematesbo/"
 PUBLIC_FILESTORE  = "https://fedlex.data.admin.ch/"
 
-# In-memory cache: {(sr, lang): (timestamp, (title, elements))}
-_law_cache: dict = {}
-LAW_CACHE_TTL = 3600  # 1 hour
-
+# Parsed laws are shared by all workers on disk (size-bounded LRU) with a small
+# per-process front. Entries older than LAW_CACHE_TTL are still served while a
+# background refresh revalidates them with a conditional GET; a 304 only records
+# the new check time (VerificheLeggi) instead of rewriting the whole entry.
+LAW_CACHE_TTL   = 3600  # 1 hour
+LAW_LEASE       = 120   # seconds a worker may hold a law's revalidation
+LAW_MEMORIA_MAX = int(os.getenv("LAW_MEMORIA_MAX", "8"))
+_law_cache = DiskCache("leggi", int(os.getenv("LAW_CACHE_MB", "256")) * 1024 * 1024)
+_law_memoria: OrderedDict = OrderedDict()
+_law_memoria_lock = threading.Lock()
+_law_inflight = SingleFlight()
+_law_refresh = ThreadPoolExecutor(max_workers=2)
+_law_refresh_in_corso: set = set()
+_law_refresh_lock = threading.Lock()
+
+
+class VerificheLeggi(SQLiteStore):
+    """Last successful check of each cached law version, and cross-process revalidation leases."""
+
+    def _crea_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS verifiche ("
+            " key TEXT PRIMARY KEY, versione TEXT, verificato REAL NOT NULL DEFAULT 0,"
+            " lease REAL NOT NULL DEFAULT 0)"
+        )
 
-def _sparql_html_url(sr: str, lang: str) -> str | None:
+    def verificato(self, key: str, versione: str | None) -> float:
+        """When versione of key was last confirmed current (0 if unknown or superseded)."""
+        try:
+            row = self._conn().execute(
+                "SELECT verificato FROM verifiche WHERE key = ? AND versione IS ?", (key, versione)
+            ).fetchone()
+        except sqlite3.Error:
+            return 0.0
+        return row[0] if row else 0.0
+
+    def tocca(self, key: str, versione: str | None, verificato: float) -> None:
+        try:
+            self._conn().execute(
+                "INSERT INTO verifiche (key, versione, verificato) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET versione = excluded.versione,"
+                " verificato = CASE WHEN versione IS excluded.versione"
+                "   THEN MAX(verificato, excluded.verificato) ELSE excluded.verificato END",
+                (key, versione, verificato),
+            )
+        except sqlite3.Error:
+            pass
+
+    def prendi(self, key: str, durata: float) -> bool:
+        """Take the revalidation lease of key unless another worker holds an unexpired one."""
+        now = time.time()
+        try:
+            cur = self._conn().execute(
+                "INSERT INTO verifiche (key, lease) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET lease = excluded.lease WHERE lease <= ?",
+                (key, now + durata, now),
+            )
+        except sqlite3.Error:
+            return True  # store unavailable: revalidate rather than serve stale forever
+        return cur.rowcount == 1
+
+    def rilascia(self, key: str) -> None:
+        try:
+            self._conn().execute("UPDATE verifiche SET lease = 0 WHERE key = ?", (key,))
+        except sqlite3.Error:
+            pass
+
+
+_verifiche_leggi = VerificheLeggi("leggi_verifiche")
+
+
+SPARQL_CACHE_TTL = int(os.getenv("SPARQL_CACHE_TTL", str(6 * 3600)))
+SPARQL_BATCH     = 40
+_sparql_cache = DiskCache("sparql_url", 8 * 1024 * 1024, ttl=SPARQL_CACHE_TTL)
+
+
+def _sparql_html_url(sr: str, lang: str, fresco: bool = False) -> str | None:
     """Get the most recent public HTML file URL for a law via Fedlex SPARQL."""
-    query = f"""PREFIX jolux: <http://data.legilux.public.lu/resource/ontology/jolux#>
-SELECT ?htmlUrl WHERE {{
-  ?act jolux:historicalLegalId "{sr}" .
+    return _sparql_html_urls([(sr, lang)], fresco).get((sr, lang))
+
+
+@misura("sparql")
+def _sparql_html_urls(coppie, fresco: bool = False) -> dict:
+    """Resolve many (sr, lang) pairs to their latest public HTML URL with one SPARQL query per batch.
+
+    Resolutions are cached on their own (SPARQL_CACHE_TTL), separately from parsed content;
+    fresco=True skips the cached ones (and refreshes them).
+    Pairs with no HTML manifestation map to None; malformed pairs are skipped.
+    """
+    risultati = {}
+    mancanti  = []
+    for sr, lang in dict.fromkeys(coppie):
+        if not re.fullmatch(r"[0-9A-Za-z._-]+", sr) or not re.fullmatch(r"[a-z]{2}", lang):
+            continue
+        cached = None if fresco else _sparql_cache.get(f"{sr}|{lang}")
+        if cached:
+            risultati[(sr, lang)] = cached
+        else:
+            risultati[(sr, lang)] = None
+            mancanti.append((sr, lang))
+
+    for i in range(0, len(mancanti), SPARQL_BATCH):
+        valori = " ".join(f'("{sr}" "{lang}")' for sr, lang in mancanti[i : i + SPARQL_BATCH])
+        # dateAct URIs end in the consolidation date, so MAX over "dateAct|url" picks the newest version.
+        query = f"""PREFIX jolux: <http://data.legilux.public.lu/resource/ontology/jolux#>
+SELECT ?sr ?lang (MAX(CONCAT(STR(?dateAct), "|", STR(?htmlUrl))) AS ?best) WHERE {{
+  VALUES (?sr ?lang) {{ {valori} }}
+  ?act jolux:historicalLegalId ?sr .
   ?dateAct jolux:isMemberOf ?act .
   ?dateAct jolux:isRealizedBy ?expr .
-  FILTER(STRENDS(STR(?expr), "/{lang}"))
+  FILTER(STRENDS(STR(?expr), CONCAT("/", ?lang)))
   ?expr jolux:isEmbodiedBy ?htmlManif .
   FILTER(STRENDS(STR(?htmlManif), "/html"))
   ?htmlManif jolux:isExemplifiedByPrivate ?htmlUrl .
 }}
-ORDER BY DESC(STR(?dateAct)) LIMIT 1"""
-    r = requests.post(
-        SPARQL_ENDPOINT, data={"query": query},
-        headers={"Accept": "application/sparql-results+json"}, timeout=12
-    )
-    r.raise_for_status()
-    bindings = r.json().get("results", {}).get("bindings", [])
-    if not bindings:
-        return None
-    private_url = bindings[0]["htmlUrl"]["value"]
-    return private_url.replace(PRIVATE_FILESTORE, PUBLIC_FILESTORE)
+GROUP BY ?sr ?lang"""
+        r = http_post(
+            SPARQL_ENDPOINT, data={"query": query}, idempotente=True,  # a read-only query
+            headers={"Accept": "application/sparql-results+json"}, timeout=12
+        )
+        r.raise_for_status()
+        for b in r.json().get("results", {}).get("bindings", []):
+            chiave = (b["sr"]["value"], b["lang"]["value"])
+            private_url = b["best"]["value"].rsplit("|", 1)[-1]
+            url = private_url.replace(PRIVATE_FILESTORE, PUBLIC_FILESTORE)
+            risultati[chiave] = url
+            _sparql_cache.set(f"{chiave[0]}|{chiave[1]}", url)
+    return risultati
 
 
-def _parse_fedlex_html(html: str) -> tuple:
+def _parse_fedlex_html_regex(html: str) -> tuple:
     """Parse fedlex law HTML into (title, elements) using fast regex (no BS4 needed)."""
     # Title
     t = re.search(r'class="erlasstitel[^"]*"[^>]*>(.*?)</h\d>', html, re.DOTALL)
@@ -477,7 +2284,385 @@ def _parse_fedlex_html(html: str) -> tuple:
     return title, [e[1] for e in events]
 
 
-@app.route("/legge", methods=["GET"])
+# Parser selection: "regex" (default) or "lxml". The lxml parser is still slower on
+# real fedlex pages and decodes entities the regex parser leaves in place, so /legge
+# output differs; switch only once bench/parser_fedlex.py shows it faster and identical.
+FEDLEX_PARSER = os.getenv("FEDLEX_PARSER", "regex")
+
+_RE_NOTA_FINALE = re.compile(r"[\s\u00a0]+\d{1,4}\s*$")
+_RE_CLASSE_NOTA = re.compile(r"fn|footnote|fussnote")
+_RE_PREFISSO_ART = re.compile(r"^Art\.?\s*\S+\s*")
+_CLASSI_PARAGRAFO = ("absatz", "ingress", "man-template")
+_TAG_SEZIONE = ("h1", "h2", "h3", "h4", "h5", "div")
+_HTML_PARSER = etree.HTMLParser(collect_ids=False)
+
+
+def _stacca(nodi) -> None:
+    """Remove nodes from the tree; their tail text sticks to what preceded them, with no separator."""
+    for n in nodi:
+        parent = n.getparent()
+        if parent is None:
+            continue
+        prev = n.getprevious()
+        if prev is not None:
+            prev.tail = (prev.tail or "") + (n.tail or "")
+        else:
+            parent.text = (parent.text or "") + (n.tail or "")
+        parent.remove(n)
+
+
+def _testo_spaziato(el) -> str:
+    """Text of el with a space at every tag boundary (the regex parser's <[^>]+> -> ' '), whitespace collapsed."""
+    return " ".join((el.text or "" if len(el) == 0 else " ".join(el.itertext())).split())
+
+
+def _testo_piatto(el) -> str:
+    return " ".join("".join(el.itertext()).split())
+
+
+def _is_nota(el) -> bool:
+    """Footnote markers dropped from paragraph text, as in the regex parser's _clean_para."""
+    if el.tag == "span":
+        return bool(_RE_CLASSE_NOTA.search(el.get("class", "")))
+    return not el.attrib and len(el) == 0
+
+
+def _pulisci_paragrafo(el) -> str:
+    _stacca([n for n in el.iter("span", "sup") if _is_nota(n)])
+    txt = _testo_spaziato(el)
+    return _RE_NOTA_FINALE.sub("", txt) if txt[-1:].isdigit() else txt
+
+
+def _paragrafi_articolo(article) -> list:
+    paras = []
+    consumati = set()  # p/dl nested in an element already emitted
+    for el in article.iter("p", "dl"):
+        if el in consumati:
+            continue
+        if el.tag == "dl":
+            consumati.update(el.iter("p", "dl"))
+            for dt in el:
+                dd = dt.getnext()
+                if dt.tag != "dt" or dd is None or dd.tag != "dd":
+                    continue
+                num = _pulisci_paragrafo(dt).strip()
+                txt = _pulisci_paragrafo(dd)
+                if txt and len(txt) > 1:
+                    ptype = "ziff" if re.match(r"^\d", num) else "litera"
+                    paras.append({"n": num, "text": txt, "type": ptype})
+        elif el.get("class", "").startswith(_CLASSI_PARAGRAFO):
+            consumati.update(el.iter("p", "dl"))
+            n = None
+            if len(el) and not (el.text or "").strip():
+                sup = el[0]
+                if sup.tag == "sup" and not sup.attrib and len(sup) == 0 and 1 <= len(sup.text or "") <= 6:
+                    n = sup.text.strip()
+            txt = _pulisci_paragrafo(el)
+            if txt and len(txt) > 1:
+                paras.append({"n": n, "text": txt, "type": "absatz"})
+    return paras
+
+
+def _parse_fedlex_html_lxml(html: str) -> tuple:
+    """Parse fedlex law HTML into (title, elements) in a single walk over an lxml tree.
+
+    Produces the same structure as _parse_fedlex_html_regex; unlike the regex
+    parser, HTML entities in the text are decoded.
+    """
+    root = etree.fromstring(html, _HTML_PARSER)
+    if root is None:
+        raise ValueError("documento vuoto")
+
+    t = s = None
+    for el in root.iter():
+        classe = el.get("class") if isinstance(el.tag, str) else None
+        if not classe:
+            continue
+        if t is None and classe.startswith("erlasstitel"):
+            t = el
+        elif s is None and classe.startswith("erlasskurztitel"):
+            s = el
+        if t is not None and s is not None:
+            break
+    title = "".join(t.itertext()) if t is not None else ""
+    if s is not None:
+        title += " " + "".join(s.itertext())
+    title = " ".join(title.split())
+
+    # Like the regex parser, everything after the opening tag of the main text counts.
+    inizio = (root.xpath('(//main[@id="maintext"])[1]')
+              or root.xpath('(//div[@id="lawcontent"])[1]') or [None])[0]
+
+    elements = []
+    attivo = inizio is None
+    coperti = ()  # heading tags opened before the end of the last heading's link (the regex skips them)
+    for el in root.iter("main", "article", *_TAG_SEZIONE):
+        if not attivo:
+            attivo = el is inizio
+            continue
+        tag = el.tag
+        if tag == "article":
+            art_id = el.get("id", "")
+            if not art_id.startswith("art_") or el.keys()[0] != "id":
+                continue
+            art_num_str = re.sub(r"_([a-z])", r"\1", art_id[4:])
+            heading = f"Art. {art_num_str}"
+            h6 = next((h for h in el.iter("h6") if h.get("class", "").startswith("heading")), None)
+            if h6 is not None:
+                _stacca([n for n in h6.iter("span", "sup") if n.tag == "span" or not n.attrib])
+                h6_txt = _testo_spaziato(h6)
+                title_extra = _RE_PREFISSO_ART.sub("", h6_txt).strip()
+                if title_extra:
+                    heading = f"Art. {art_num_str} {title_extra}"
+            elements.append({
+                "type": "article",
+                "id": art_id,
+                "heading": heading,
+                "paras": _paragrafi_articolo(el),
+            })
+        elif tag != "main" and el.get("class", "").startswith("heading"):
+            if el in coperti:
+                continue
+            link = next((a for a in el.iter("a") if a.get("href") is not None), None)
+            if link is None:
+                continue
+            coperti = set(link.iter(*_TAG_SEZIONE))
+            for d in el.iter():
+                if d is link:
+                    break
+                coperti.add(d)
+            text = _testo_piatto(link)
+            if text:
+                elements.append({"type": tag if tag != "div" else "h6", "text": text})
+    return title, elements
+
+
+@misura("parse_fedlex")
+def _parse_fedlex_html(html: str) -> tuple:
+    """Parse fedlex law HTML into (title, elements) with the parser chosen by FEDLEX_PARSER."""
+    if FEDLEX_PARSER == "lxml":
+        try:
+            return _parse_fedlex_html_lxml(html)
+        except (etree.LxmlError, ValueError):
+            pass
+    return _parse_fedlex_html_regex(html)
+
+
+def _memorizza_legge(key: str, voce: dict) -> None:
+    with _law_memoria_lock:
+        _law_memoria[key] = voce
+        _law_memoria.move_to_end(key)
+        while len(_law_memoria) > LAW_MEMORIA_MAX:
+            _law_memoria.popitem(last=False)
+
+
+def _con_verifica(key: str, voce: dict) -> dict:
+    """voce with the latest check time any worker recorded for its version."""
+    verificato = _verifiche_leggi.verificato(key, voce.get("versione"))
+    return {**voce, "verificato": verificato} if verificato > voce["verificato"] else voce
+
+
+def _legge_in_cache(key: str) -> dict | None:
+    """Return the cached law entry (possibly stale), preferring the in-process copy while fresh."""
+    with _law_memoria_lock:
+        voce = _law_memoria.get(key)
+        if voce is not None:
+            _law_memoria.move_to_end(key)
+    if voce is not None and time.time() - voce["verificato"] < LAW_CACHE_TTL:
+        _metriche.incrementa("sententia_cache_totale", cache="leggi_memoria", esito="hit")
+        return voce
+    # Another worker may have revalidated it (only the check time changes) ...
+    if voce is not None:
+        verificata = _con_verifica(key, voce)
+        if time.time() - verificata["verificato"] < LAW_CACHE_TTL:
+            _memorizza_legge(key, verificata)
+            return verificata
+    # ... or stored a newer version.
+    su_disco = _law_cache.get(key)
+    if su_disco is not None:
+        su_disco = _con_verifica(key, su_disco)
+        if voce is None or su_disco["verificato"] > voce["verificato"]:
+            _memorizza_legge(key, su_disco)
+            return su_disco
+    return voce
+
+
+@misura("fedlex")
+def _scarica_legge(sr: str, lang: str, precedente: dict | None = None,
+                   html_url: str | None = None) -> dict | None:
+    """Resolve, download and parse a law; revalidates precedente with If-None-Match/If-Modified-Since.
+
+    Revalidation resolves the URL again, bypassing the SPARQL cache, so a new
+    consolidated version is picked up within LAW_CACHE_TTL; if SPARQL is
+    unavailable the previous file is revalidated instead.
+    """
+    if not html_url and precedente:
+        try:
+            html_url = _sparql_html_url(sr, lang, fresco=True)
+        except Exception:
+            html_url = None
+        html_url = html_url or precedente["html_url"]
+    html_url = html_url or _sparql_html_url(sr, lang)
+    if not html_url:
+        return None
+    headers = {"User-Agent": "Mozilla/5.0"}
+    if precedente and precedente["html_url"] == html_url:
+        if precedente.get("etag"):
+            headers["If-None-Match"] = precedente["etag"]
+        if precedente.get("last_modified"):
+            headers["If-Modified-Since"] = precedente["last_modified"]
+    r = http_get(html_url, headers=headers, timeout=25)
+    if r.status_code == 304 and precedente:
+        return {**precedente, "verificato": time.time()}
+    html_text = r.content.decode("utf-8", errors="replace")
+    if not r.ok or len(html_text) < 5000:
+        return None
+    title, elements = _parse_fedlex_html(html_text)
+    return {
+        "html_url": html_url,
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+        "versione": hashlib.sha256(r.content).hexdigest()[:16],
+        "verificato": time.time(),
+        "titolo": title,
+        "articoli": elements,
+        "indice": _indicizza_legge(elements),
+    }
+
+
+def _numero_articolo(art: str) -> str:
+    """Normalize "art_653_a", "Art. 653a" or "653 a" to "653a"."""
+    art = re.sub(r"^art[._\s]*", "", art.strip().lower())
+    return re.sub(r"[\s_]+", "", art)
+
+
+def _indicizza_legge(elements: list) -> dict:
+    """Map article numbers to positions and headings to the [inizio, fine) span they cover."""
+    articoli = {}
+    sezioni  = []
+    aperte   = []  # (level, index in sezioni) of headings whose span is still open
+    for pos, el in enumerate(elements):
+        if el["type"] == "article":
+            articoli.setdefault(_numero_articolo(el["id"]), pos)
+            continue
+        livello = int(el["type"][1])
+        while aperte and aperte[-1][0] >= livello:
+            sezioni[aperte.pop()[1]]["fine"] = pos
+        sezioni.append({"n": len(sezioni), "type": el["type"], "text": el["text"],
+                        "inizio": pos, "fine": len(elements)})
+        aperte.append((livello, len(sezioni) - 1))
+    return {"articoli": articoli, "sezioni": sezioni}
+
+
+LEGGE_PER_PAGINA_MAX = 500
+
+
+def _intero(valore: str, minimo: int) -> int | None:
+    """valore as an int >= minimo, or None if it is not one."""
+    try:
+        n = int(valore)
+    except (TypeError, ValueError):
+        return None
+    return n if n >= minimo else None
+
+
+def _seleziona_legge(voce: dict, args) -> tuple:
+    """Apply ?art, ?da/?a, ?sezione, ?indice or ?pagina/?per_pagina to a cached law.
+
+    Returns (campi extra per la risposta, errore, status); without any of these
+    parameters the full article list is returned unchanged. Unknown articles
+    are 404, malformed or out-of-range parameters 400.
+    """
+    elements = voce["articoli"]
+    indice   = voce.get("indice") or _indicizza_legge(elements)
+    totale   = {"totale": len(elements)}
+
+    def posizione(art):
+        return indice["articoli"].get(_numero_articolo(art))
+
+    if args.get("indice") in ("1", "true"):
+        return {"sezioni": indice["sezioni"], **totale}, None, 200
+
+    if args.get("art"):
+        pos = posizione(args["art"])
+        if pos is None:
+            return None, "Articolo non trovato", 404
+        return {"articoli": [elements[pos]], **totale}, None, 200
+
+    if args.get("da") or args.get("a"):
+        inizio = posizione(args["da"]) if args.get("da") else 0
+        fine   = posizione(args["a"]) if args.get("a") else len(elements) - 1
+        if inizio is None or fine is None:
+            return None, "Articolo non trovato", 404
+        if fine < inizio:
+            return None, "Intervallo di articoli non valido", 400
+        return {"articoli": elements[inizio : fine + 1], **totale}, None, 200
+
+    if args.get("sezione"):
+        n = _intero(args["sezione"], 0)
+        if n is None or n >= len(indice["sezioni"]):
+            return None, "Parametro 'sezione' non valido", 400
+        sezione = indice["sezioni"][n]
+        return {"sezione": sezione, "articoli": elements[sezione["inizio"] : sezione["fine"]], **totale}, None, 200
+
+    if args.get("pagina") or args.get("per_pagina"):
+        pagina     = _intero(args.get("pagina", "1"), 1)
+        per_pagina = _intero(args.get("per_pagina", "100"), 1)
+        if pagina is None or per_pagina is None:
+            return None, "Parametri di paginazione non validi", 400
+        per_pagina = min(LEGGE_PER_PAGINA_MAX, per_pagina)
+        inizio = (pagina - 1) * per_pagina
+        return {
+            "articoli": elements[inizio : inizio + per_pagina],
+            "pagina": pagina,
+            "per_pagina": per_pagina,
+            "pagine": (len(elements) + per_pagina - 1) // per_pagina,
+            **totale,
+        }, None, 200
+
+    return {"articoli": elements}, None, 200
+
+
+def _carica_legge(sr: str, lang: str, precedente: dict | None = None,
+                  html_url: str | None = None) -> dict | None:
+    key  = f"{sr}|{lang}"
+    voce = _scarica_legge(sr, lang, precedente, html_url)
+    if voce is not None:
+        invariata = (precedente is not None and voce["html_url"] == precedente["html_url"]
+                     and voce.get("versione") == precedente.get("versione"))
+        if not invariata:  # unchanged (304 or same bytes): only the check time is new
+            _law_cache.set(key, voce)
+        _verifiche_leggi.tocca(key, voce.get("versione"), voce["verificato"])
+        _memorizza_legge(key, voce)
+    return voce
+
+
+def _rivalida_legge(sr: str, lang: str, voce: dict) -> None:
+    """Refresh a stale law in the background, at most once at a time per law across all workers."""
+    key = f"{sr}|{lang}"
+    with _law_refresh_lock:
+        if key in _law_refresh_in_corso:
+            return
+        _law_refresh_in_corso.add(key)
+    if not _verifiche_leggi.prendi(key, LAW_LEASE):
+        with _law_refresh_lock:
+            _law_refresh_in_corso.discard(key)
+        return
+
+    def rinnova():
+        try:
+            _carica_legge(sr, lang, voce)
+        except Exception:
+            pass  # keep serving the stale copy; the next request retries
+        finally:
+            _verifiche_leggi.rilascia(key)
+            with _law_refresh_lock:
+                _law_refresh_in_corso.discard(key)
+
+    _law_refresh.submit(rinnova)
+
+
+@bp.route("/legge", methods=["GET"])
 @limiter.limit("10 per minute; 60 per day")
 def get_legge():
     sr         = request.args.get("sr",          "").strip()
@@ -487,94 +2672,618 @@ def get_legge():
     if not sr:
         return jsonify({"errore": "Parametro 'sr' mancante"}), 400
 
-    # Check cache
-    cache_key = (sr, lang)
-    cached = _law_cache.get(cache_key)
-    if cached and (time.time() - cached[0]) < LAW_CACHE_TTL:
-        title, elements = cached[1]
-        return jsonify({"sr": sr, "lang": lang, "titolo": title,
-                        "url": fedlex_url, "articoli": elements})
-
-    # Find HTML URL via SPARQL
-    html_url = None
-    try:
-        html_url = _sparql_html_url(sr, lang)
-    except Exception:
-        pass
-
-    if not html_url:
-        return jsonify({"sr": sr, "url": fedlex_url, "solo_link": True}), 206
-
-    # Fetch HTML from public filestore
-    try:
-        r = requests.get(
-            html_url, headers={"User-Agent": "Mozilla/5.0"}, timeout=25
-        )
-        html_text = r.content.decode("utf-8", errors="replace")
-        if not r.ok or len(html_text) < 5000:
+    cache_key = f"{sr}|{lang}"
+    voce = _legge_in_cache(cache_key)
+    if voce is None:
+        try:
+            voce = _law_inflight.do(cache_key, lambda: _carica_legge(sr, lang))
+        except Exception:
+            voce = None
+        if voce is None:
             return jsonify({"sr": sr, "url": fedlex_url, "solo_link": True}), 206
-    except Exception:
-        return jsonify({"sr": sr, "url": fedlex_url, "solo_link": True}), 206
-
-    # Parse
-    title, elements = _parse_fedlex_html(html_text)
-
-    # Cache
-    _law_cache[cache_key] = (time.time(), (title, elements))
-
-    return jsonify({
+    elif time.time() - voce["verificato"] >= LAW_CACHE_TTL:
+        _rivalida_legge(sr, lang, voce)
+
+    selezione, errore, stato = _seleziona_legge(voce, request.args)
+    if errore:
+        return jsonify({"errore": errore}), stato
+    # Only the canonical body is precompressed: a client-chosen fedlex_url must not
+    # make us serialize and compress a whole law per distinct value.
+    if selezione.get("articoli") is voce["articoli"] and fedlex_url in ("", voce["html_url"]):
+        return _risposta_precompressa(cache_key, voce)
+    risposta = _risposta_legge(sr, lang, voce, fedlex_url)
+    del risposta["articoli"]
+    risposta.update(selezione)
+    return jsonify(risposta)
+
+
+def _risposta_legge(sr, lang, voce, fedlex_url=""):
+    if voce is None:
+        return {"sr": sr, "lang": lang, "url": fedlex_url, "solo_link": True}
+    return {
         "sr": sr,
         "lang": lang,
-        "titolo": title,
-        "url": fedlex_url or html_url,
-        "articoli": elements,
-    })
-
+        "titolo": voce["titolo"],
+        "url": fedlex_url or voce["html_url"],
+        "articoli": voce["articoli"],
+    }
+
+
+# ── Risposte /legge precompresse (ETag = hash del contenuto, varianti gzip/brotli) ──
+
+# The full-law body is serialized once per (law version, Fedlex url) and stored under its content
+# hash together with its gzip and brotli variants, so cache hits only copy bytes.
+
+LAW_PAYLOAD_MEMORIA_MB = int(os.getenv("LAW_PAYLOAD_MEMORIA_MB", "64"))
+# Quality 11 costs ~25x the CPU of 9 on a 1 MB law for a few percent smaller bodies.
+LAW_BROTLI_QUALITY     = int(os.getenv("LAW_BROTLI_QUALITY", "9"))
+CODIFICHE_LEGGE        = ("br", "gzip", "identity")
+_payload_etag = DiskCache("leggi_etag", 4 * 1024 * 1024)
+_payload_blob = BlobCache("leggi_payload", int(os.getenv("LAW_PAYLOAD_MB", "512")) * 1024 * 1024)
+_payload_inflight = SingleFlight()
+_payload_memoria: OrderedDict = OrderedDict()
+_payload_memoria_lock = threading.Lock()
+_payload_memoria_bytes = 0
+# Its own worker, so compressing a large law never delays revalidations on _law_refresh.
+_compressione_brotli = ThreadPoolExecutor(max_workers=1)
+
+
+def _blob_payload(etag: str, codifica: str) -> bytes | None:
+    global _payload_memoria_bytes
+    key = f"{etag}|{codifica}"
+    with _payload_memoria_lock:
+        blob = _payload_memoria.get(key)
+        if blob is not None:
+            _payload_memoria.move_to_end(key)
+            return blob
+    blob = _payload_blob.get(key)
+    if blob is None:
+        return None
+    with _payload_memoria_lock:
+        if key not in _payload_memoria:
+            _payload_memoria[key] = blob
+            _payload_memoria_bytes += len(blob)
+        while _payload_memoria_bytes > LAW_PAYLOAD_MEMORIA_MB * 1024 * 1024 and _payload_memoria:
+            _payload_memoria_bytes -= len(_payload_memoria.popitem(last=False)[1])
+    return blob
+
+
+def _comprimi_brotli(etag: str, corpo: bytes) -> None:
+    if _payload_blob.get(f"{etag}|br") is None:
+        _payload_blob.set(f"{etag}|br", brotli.compress(corpo, quality=LAW_BROTLI_QUALITY))
+
+
+def _crea_payload(mappa: str, voce: dict, url: str) -> str:
+    """Serialize the full /legge body as jsonify would, store it and its gzip variant; brotli follows in the background."""
+    sr, lang = mappa.split("|")[:2]
+    risposta = _risposta_legge(sr, lang, voce, url)
+    corpo = (current_app.json.dumps(risposta, separators=(",", ":")) + "\n").encode("utf-8")
+    etag  = hashlib.sha256(corpo).hexdigest()[:32]
+    _payload_blob.set(f"{etag}|identity", corpo)
+    _payload_blob.set(f"{etag}|gzip", gzip.compress(corpo, compresslevel=9, mtime=0))
+    _payload_etag.set(mappa, etag)
+    _compressione_brotli.submit(_comprimi_brotli, etag, corpo)
+    return etag
+
+
+def _risposta_precompressa(key: str, voce: dict) -> Response:
+    """Serve the full law from its precomputed payload, with ETag/If-None-Match and Accept-Encoding negotiation."""
+    url   = voce["html_url"]
+    mappa = f"{key}|{voce.get('versione') or voce['verificato']}|{url}"
+    etag  = _payload_etag.get(mappa) or _payload_inflight.do(mappa, lambda: _crea_payload(mappa, voce, url))
+
+    codifica = request.accept_encodings.best_match(CODIFICHE_LEGGE[:2]) or "identity"
+    corpo = _blob_payload(etag, codifica)
+    if corpo is None and codifica == "br":
+        codifica = "gzip" if request.accept_encodings["gzip"] else "identity"  # brotli not ready yet
+        corpo = _blob_payload(etag, codifica)
+    if corpo is None:  # evicted from the blob store: rebuild
+        etag  = _payload_inflight.do(mappa, lambda: _crea_payload(mappa, voce, url))
+        corpo = _blob_payload(etag, codifica)
+
+    tag = etag if codifica == "identity" else f"{etag}-{codifica}"
+    if any(request.if_none_match.contains_weak(t) for t in (etag, f"{etag}-gzip", f"{etag}-br")):
+        risposta = Response(status=304)
+    else:
+        risposta = Response(corpo, mimetype="application/json")
+        if codifica != "identity":
+            risposta.headers["Content-Encoding"] = codifica
+    risposta.set_etag(tag)
+    risposta.headers["Vary"] = "Accept-Encoding"
+    risposta.headers["Cache-Control"] = "no-cache"
+    return risposta
+
+
+LEGGI_MAX = 30
+
+
+@bp.route("/leggi", methods=["GET"])
+@limiter.limit("5 per minute; 40 per day")
+def get_leggi():
+    """Bulk /legge: ?sr=210,220&lang=it,de. All SR numbers are resolved in one SPARQL query
+    and the HTML files are downloaded concurrently; ?stream=1 emits each law as NDJSON when ready."""
+    srs   = [x.strip() for v in request.args.getlist("sr") for x in v.split(",") if x.strip()]
+    langs = [x.strip().lower() for v in request.args.getlist("lang") for x in v.split(",") if x.strip()] or ["it"]
+    if not srs:
+        return jsonify({"errore": "Parametro 'sr' mancante"}), 400
+    coppie = list(dict.fromkeys((sr, lang) for sr in srs for lang in langs))
+    if len(coppie) > LEGGI_MAX:
+        return jsonify({"errore": f"Massimo {LEGGI_MAX} leggi per richiesta"}), 400
+
+    pronte, mancanti = {}, []
+    for sr, lang in coppie:
+        voce = _legge_in_cache(f"{sr}|{lang}")
+        if voce is None:
+            mancanti.append((sr, lang))
+            continue
+        if time.time() - voce["verificato"] >= LAW_CACHE_TTL:
+            _rivalida_legge(sr, lang, voce)
+        pronte[(sr, lang)] = voce
 
-@app.route("/sintesi", methods=["GET"])
+    try:
+        html_urls = _sparql_html_urls(mancanti) if mancanti else {}
+    except Exception:
+        html_urls = {}
+
+    def carica(coppia):
+        sr, lang = coppia
+        html_url = html_urls.get(coppia)
+        if not html_url:
+            return coppia, None
+        try:
+            return coppia, _law_inflight.do(f"{sr}|{lang}", lambda: _carica_legge(sr, lang, html_url=html_url))
+        except Exception:
+            return coppia, None
+
+    def completate():
+        for coppia, voce in pronte.items():
+            yield coppia, voce
+        if mancanti:
+            with EsecutoreContesto(max_workers=min(6, len(mancanti))) as ex:
+                for fut in as_completed([ex.submit(carica, c) for c in mancanti]):
+                    yield fut.result()
+
+    if request.args.get("stream") in ("1", "true"):
+        def genera():
+            for (sr, lang), voce in completate():
+                yield json.dumps(_risposta_legge(sr, lang, voce), ensure_ascii=False) + "\n"
+
+        return Response(stream_with_context(genera()), mimetype="application/x-ndjson")
+
+    caricate = dict(completate())
+    return jsonify({"leggi": [_risposta_legge(sr, lang, caricate[(sr, lang)]) for sr, lang in coppie]})
+
+
+@bp.route("/sintesi", methods=["GET"])
 @limiter.limit("10 per minute; 50 per day")
 def get_summary():
     codice = request.args.get("codice", "").strip()
     lang   = request.args.get("lang", "it")
     if not codice:
         return jsonify({"errore": "Parametro 'codice' mancante"}), 400
+    if coda_llm_piena(PRIORITA_INTERATTIVA) and not _sintesi_cache.get(chiave_sintesi("sintesi", codice, lang)):
+        return risposta_sovraccarico()
 
-    if is_bvger_code(codice):
-        uuid = cerca_uuid_bvger(codice)
-        if not uuid:
-            return jsonify({"errore": "Sentenza BVGer non trovata su weblaw.ch."}), 404
-        testo = estrai_testo_bvger(uuid)
-    else:
-        url   = costruisci_url_bgerli(codice)
-        testo = estrai_testo_sentenza(url)
+    def recupera_testo():
+        return recupera_testo_sentenza(codice)
 
-    if not testo or testo.startswith("ERRORE") or len(testo) < 100:
-        return jsonify({"errore": "Impossibile recuperare il testo della sentenza."}), 404
-    sintesi = sintetizza_testo_sentenza_4_punti(testo, lang)
+    if request.args.get("stream") in ("1", "true"):
+        return _sintesi_stream(codice, lang, recupera_testo)
+
+    def calcola():
+        testo, errore = recupera_testo()
+        if not testo:
+            return None, errore
+        sintesi = sintetizza_testo_sentenza_4_punti(testo, lang)
+        indicizza_sentenza(codice, testo, sintesi)
+        return sintesi, None
+
+    try:
+        sintesi, errore = sintesi_con_cache("sintesi", codice, lang, calcola)
+    except BudgetLLMEsaurito:
+        return risposta_sovraccarico()
+    if not sintesi:
+        return jsonify({"errore": errore}), 404
     return jsonify({"sintesi": sintesi})
 
 
-@app.route("/html_federale", methods=["GET"])
+class DirettaSintesi:
+    """Deltas of a summary being streamed, replayed to every client that asks for it meanwhile."""
+
+    def __init__(self):
+        self._cond  = threading.Condition()
+        self._parti: list = []
+        self._esito = None  # None while running, then True (completed) or False (failed)
+
+    def aggiungi(self, delta: str) -> None:
+        with self._cond:
+            self._parti.append(delta)
+            self._cond.notify_all()
+
+    def termina(self, riuscita: bool, errore: str = "Sintesi non disponibile, riprovare più tardi") -> None:
+        with self._cond:
+            self._esito  = riuscita
+            self._errore = errore
+            self._cond.notify_all()
+
+    def vuota(self) -> bool:
+        with self._cond:
+            return not self._parti
+
+    def leggi(self):
+        """Yield every delta from the start; raise RuntimeError if the generation failed."""
+        letti = 0
+        while True:
+            with self._cond:
+                while letti == len(self._parti) and self._esito is None:
+                    self._cond.wait()
+                nuove, esito = self._parti[letti:], self._esito
+            letti += len(nuove)
+            yield from nuove
+            if esito is not None:
+                if not esito:
+                    raise RuntimeError(self._errore)
+                return
+
+
+_sintesi_dirette: dict = {}
+_sintesi_dirette_lock = threading.Lock()
+
+
+def _avvia_diretta(key, codice, lang, testo, logger) -> DirettaSintesi:
+    """Start generating the summary for key in the background, or join the one already running.
+
+    The generation does not depend on any client staying connected, and it
+    shares _sintesi_inflight with the non-streaming path, so one key costs one
+    completion however it is requested.
+    """
+    with _sintesi_dirette_lock:
+        diretta = _sintesi_dirette.get(key)
+        if diretta is not None:
+            return diretta
+        diretta = _sintesi_dirette[key] = DirettaSintesi()
+
+    def genera_sintesi():
+        cached = _sintesi_cache.get(key)
+        if cached:
+            return cached, None
+        parti = []
+        for delta in sintetizza_testo_sentenza_4_punti_stream(testo, lang):
+            parti.append(delta)
+            diretta.aggiungi(delta)
+        sintesi = "".join(parti).strip()
+        if sintesi:
+            _sintesi_cache.set(key, sintesi)
+            indicizza_sentenza(codice, testo, sintesi)
+        return sintesi, None
+
+    def produci():
+        try:
+            sintesi, _ = _sintesi_inflight.do(key, genera_sintesi)
+            if diretta.vuota() and sintesi:  # served by a computation that was already running
+                diretta.aggiungi(sintesi)
+            diretta.termina(True)
+        except BudgetLLMEsaurito:
+            diretta.termina(False, "Servizio momentaneamente sovraccarico, riprova tra poco.")
+        except Exception:
+            logger.exception("Sintesi in streaming non riuscita (%s, %s)", codice, lang)
+            diretta.termina(False)
+        finally:
+            with _sintesi_dirette_lock:
+                _sintesi_dirette.pop(key, None)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(produci,), daemon=True).start()
+    return diretta
+
+
+def _sintesi_stream(codice, lang, recupera_testo):
+    """NDJSON stream of {"delta": ...} lines followed by {"fine": true}.
+
+    Concurrent requests for the same summary follow a single generation.
+    """
+    key    = chiave_sintesi("sintesi", codice, lang)
+    cached = _sintesi_cache.get(key)
+    if not cached:
+        with _sintesi_dirette_lock:
+            diretta = _sintesi_dirette.get(key)
+        if diretta is None:
+            testo, errore = recupera_testo()
+            if not testo:
+                return jsonify({"errore": errore}), 404
+            diretta = _avvia_diretta(key, codice, lang, testo, current_app.logger)
+
+    def genera():
+        if cached:
+            yield json.dumps({"delta": cached}, ensure_ascii=False) + "\n"
+            yield json.dumps({"fine": True}) + "\n"
+            return
+        try:
+            for delta in diretta.leggi():
+                yield json.dumps({"delta": delta}, ensure_ascii=False) + "\n"
+        except RuntimeError as e:
+            # The cause is logged by the generating thread; clients get a generic message.
+            yield json.dumps({"errore": str(e)}, ensure_ascii=False) + "\n"
+            return
+        yield json.dumps({"fine": True}) + "\n"
+
+    return Response(stream_with_context(genera()), mimetype="application/x-ndjson")
+
+
+@bp.route("/html_federale", methods=["GET"])
 @limiter.limit("30 per minute")
 def get_html_federale():
+    """Fetch a bger.ch/bger.li page. ?contenuto=1 keeps only the decision body (div#content);
+    ?raw=1 returns the HTML itself instead of wrapping it in JSON, streamed through on a cache miss."""
     url = request.args.get("url", "").strip()
     if not url:
         return jsonify({"errore": "Parametro 'url' mancante"}), 400
-    allowed = ("https://bger.ch", "https://www.bger.ch", "https://bger.li")
-    if not any(url.startswith(p) for p in allowed):
+    if not url_federale_consentito(url):
         return jsonify({"errore": "URL non consentito"}), 400
+    raw       = request.args.get("raw") in ("1", "true")
+    contenuto = request.args.get("contenuto") in ("1", "true")
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120 Safari/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-            "Accept-Language": "it,de,fr,en;q=0.5",
-        }
-        resp = requests.get(url, timeout=20, headers=headers, allow_redirects=True)
-        resp.raise_for_status()
-        return jsonify({"html": resp.text, "url": resp.url})
+        if raw and not contenuto and _pagine_cache.get(url) is None:
+            return _stream_pagina_federale(url)
+        pagina = pagina_federale(url)
     except Exception as e:
         return jsonify({"errore": str(e)}), 500
 
+    html = pagina["html"]
+    if contenuto:
+        content = contenuto_sentenza(html)
+        if content is None:
+            return jsonify({"errore": "Contenuto della sentenza non trovato", "url": pagina["url"]}), 404
+        html = etree.tostring(content, encoding="unicode", method="html", with_tail=False)
+    if raw:
+        return Response(html, content_type="text/html; charset=utf-8",
+                        headers={"X-Url-Finale": pagina["url"], **HEADERS_HTML_GREZZO})
+    return jsonify({"html": html, "url": pagina["url"]})
+
+
+# Upstream HTML served from our origin must not run scripts or reach our cookies.
+HEADERS_HTML_GREZZO = {"Content-Security-Policy": "sandbox", "X-Content-Type-Options": "nosniff"}
+
+
+def _origine(url: str):
+    parti = urlsplit(url)
+    if parti.username is not None or parti.password is not None:
+        return None
+    try:
+        return parti.scheme, parti.hostname, parti.port
+    except ValueError:  # malformed port
+        return None
+
+
+def url_federale_consentito(url: str) -> bool:
+    """True for https URLs on bger.ch / www.bger.ch, or on the exact origin of BGER_LI_BASE."""
+    origine = _origine(url)
+    return origine is not None and origine in {
+        ("https", "bger.ch", None), ("https", "www.bger.ch", None), _origine(BGER_LI_BASE)}
+
+
+def _stream_pagina_federale(url: str) -> Response:
+    """Pass the upstream body through chunk by chunk, caching it once complete.
+
+    The upstream response (and its host slot) is closed when the body ends or,
+    if streaming never starts, when Flask closes the response.
+    """
+    resp = http_get(url, timeout=20, headers=HEADERS_FEDERALI, allow_redirects=True, stream=True)
+    try:
+        resp.raise_for_status()
+    except Exception:
+        resp.close()
+        raise
+
+    def genera():
+        parti, dimensione = [], 0
+        try:
+            for chunk in resp.iter_content(64 * 1024):
+                yield chunk
+                if parti is not None:
+                    parti.append(chunk)
+                    dimensione += len(chunk)
+                    if dimensione > PAGINE_FEDERALI_MAX_BYTES:
+                        parti = None
+            if parti is not None:
+                html = b"".join(parti).decode(resp.encoding or "utf-8", errors="replace")
+                memorizza_pagina_federale(url, resp.url, html)
+        finally:
+            resp.close()
+
+    risposta = Response(
+        stream_with_context(genera()),
+        content_type=resp.headers.get("Content-Type", "text/html"),
+        headers={"X-Url-Finale": resp.url, **HEADERS_HTML_GREZZO},
+    )
+    risposta.call_on_close(resp.close)
+    return risposta
+
+
+@bp.before_app_request
+def _avvia_misura():
+    g.inizio_richiesta = time.perf_counter()
+    g.tempi = TempiRichiesta()
+    _tempi_richiesta.set(g.tempi)
+
+
+@bp.after_app_request
+def _chiudi_misura(response):
+    inizio = g.get("inizio_richiesta")
+    if inizio is None:
+        return response
+    durata   = time.perf_counter() - inizio
+    endpoint = (request.endpoint or "sconosciuto").rpartition(".")[2]
+    _metriche.osserva("sententia_richiesta_secondi", durata, endpoint=endpoint)
+    _metriche.incrementa("sententia_risposte_totale", endpoint=endpoint, status=response.status_code)
+    # Streamed bodies are produced after the headers are sent, so only their stages show up in /metrics.
+    if not response.is_streamed:
+        voci = [g.tempi.server_timing(), f"totale;dur={durata * 1000:.1f}"]
+        response.headers["Server-Timing"] = ", ".join(v for v in voci if v)
+    _metriche.salva()
+    return response
+
+
+@bp.teardown_app_request
+def _termina_misura(exc):
+    _tempi_richiesta.set(None)
+
+
+@bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(_metriche.esporta(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@bp.route("/stato_llm", methods=["GET"])
+def get_stato_llm():
+    """Queue depth and budget use of the LLM scheduler, for load balancers and monitoring."""
+    profondita = _scheduler_llm.profondita()
+    chiamate, token = _scheduler_llm.consumo()
+    return jsonify({
+        "in_coda": {
+            "interattiva": profondita.get(PRIORITA_INTERATTIVA, 0),
+            "batch": profondita.get(PRIORITA_BATCH, 0),
+            "fondo": profondita.get(PRIORITA_FONDO, 0),
+        },
+        "coda_max": LLM_CODA_MAX,
+        "ultimo_minuto": {"richieste": chiamate, "token": token},
+        "budget": {"rpm": LLM_RPM, "tpm": LLM_TPM},
+    })
+
+
+# ── Comandi CLI (flask --app main <comando>) ─────────────────────────────────
+
+def _leggi_codici(sorgente):
+    with click.open_file(sorgente, encoding="utf-8") as f:
+        return [riga.strip() for riga in f if riga.strip() and not riga.startswith("#")]
+
+
+@bp.cli.command("prefetch-bvger")
+@click.argument("sorgente", default="-")
+@click.option("--concorrenza", default=4, show_default=True, help="Ricerche UUID in parallelo.")
+def prefetch_bvger(sorgente, concorrenza):
+    """Resolve BVGer codes (one per line, from a file or stdin) into the code -> UUID map."""
+    risultati = risolvi_uuid_bvger_batch(_leggi_codici(sorgente), concorrenza)
+    for codice, uuid in risultati.items():
+        click.echo(f"{codice}\t{uuid or '-'}")
+    trovati = sum(1 for u in risultati.values() if u)
+    click.echo(f"{trovati}/{len(risultati)} UUID risolti.", err=True)
+
+
+_RE_CODICE_SENTENZA = re.compile(r"\b(?:\d{1,2}[A-Z]{1,2}[_ ]\d{1,5}/\d{4}|[A-F]-\d{1,6}/\d{4})\b")
+PRESINTESI_LINGUE = os.getenv("PRESINTESI_LINGUE", "it")
+
+
+def _codici_da_feed(url: str) -> list:
+    """Decision codes mentioned in a feed (RSS, HTML or plain text), in order of appearance."""
+    r = http_get(url, timeout=30)
+    r.raise_for_status()
+    return list(dict.fromkeys(normalizza_codice(c) for c in _RE_CODICE_SENTENZA.findall(r.text)))
+
+
+def presintetizza_sentenza(codice: str, lingue, tipi) -> list:
+    """Fill the summary caches for one decision; returns (tipo, lang, esito) per summary."""
+    esiti = []
+    testo, errore = None, None
+    for tipo in tipi:
+        if tipo == "ricerca" and is_bvger_code(codice):
+            continue  # /ricerca_sentenze only serves BGer decisions
+        for lang in lingue:
+            if _sintesi_cache.get(chiave_sintesi(tipo, codice, lang)):
+                esiti.append((tipo, lang, "in cache"))
+                continue
+            if testo is None and errore is None:
+                testo, errore = recupera_testo_sentenza(codice)
+            if not testo:
+                esiti.append((tipo, lang, errore))
+                continue
+
+            def calcola(tipo=tipo, lang=lang):
+                if tipo == "sintesi":
+                    sintesi = sintetizza_testo_sentenza_4_punti(testo, lang, priorita=PRIORITA_FONDO)
+                else:
+                    sintesi = sintetizza_sentenza_10_righe(testo, lang, priorita=PRIORITA_FONDO)
+                indicizza_sentenza(codice, testo, sintesi)
+                return sintesi, None
+
+            try:
+                sintesi, errore_sintesi = sintesi_con_cache(tipo, codice, lang, calcola)
+                esiti.append((tipo, lang, "ok" if sintesi else errore_sintesi))
+            except Exception as e:
+                esiti.append((tipo, lang, f"ERRORE:{e}"))
+    return esiti
+
+
+@bp.cli.command("presintetizza")
+@click.argument("sorgente", default="-")
+@click.option("--lingue", default=PRESINTESI_LINGUE, show_default=True, help="Lingue separate da virgola.")
+@click.option("--tipi", default="sintesi,ricerca", show_default=True,
+              help="sintesi (/sintesi, 4 punti) e/o ricerca (/ricerca_sentenze, 10 righe).")
+@click.option("--concorrenza", default=3, show_default=True, help="Sentenze elaborate in parallelo.")
+@click.option("--intervallo", default=0, show_default=True,
+              help="Secondi tra due letture del feed; 0 = una sola passata.")
+def presintetizza(sorgente, lingue, tipi, concorrenza, intervallo):
+    """Precompute summaries for new BGer/BVGer decisions.
+
+    SORGENTE is a file with one code per line, "-" for stdin, or an http(s)
+    feed URL whose text is scanned for decision codes. LLM calls run at the
+    lowest scheduler priority, behind user requests.
+    """
+    lingue = [l.strip() for l in lingue.split(",") if l.strip()]
+    tipi   = [t.strip() for t in tipi.split(",") if t.strip() in VERSIONI_PROMPT]
+    while True:
+        try:
+            if sorgente.startswith(("http://", "https://")):
+                codici = _codici_da_feed(sorgente)
+            else:
+                codici = [normalizza_codice(c) for c in _leggi_codici(sorgente)]
+        except Exception as e:
+            if intervallo <= 0:
+                raise
+            # A feed that is down or malformed once must not stop the polling loop.
+            click.echo(f"Lettura di {sorgente} non riuscita: {type(e).__name__}: {e}", err=True)
+            codici = []
+        with ThreadPoolExecutor(max_workers=max(1, concorrenza)) as ex:
+            futuri = {ex.submit(presintetizza_sentenza, c, lingue, tipi): c for c in codici}
+            for fut in as_completed(futuri):
+                try:
+                    esiti = fut.result()
+                except Exception as e:
+                    click.echo(f"{futuri[fut]}\t-\t-\tERRORE:{type(e).__name__}: {e}", err=True)
+                    continue
+                for tipo, lang, esito in esiti:
+                    click.echo(f"{futuri[fut]}\t{tipo}\t{lang}\t{esito}")
+        if intervallo <= 0:
+            break
+        time.sleep(intervallo)
+
+
+# ── App factory e precaricamento (gunicorn --preload) ────────────────────────
+
+def create_app() -> Flask:
+    """Build a Flask app; the API keys are checked where each one is used."""
+    app = Flask(__name__)
+    CORS(app)
+    limiter.init_app(app)
+    app.register_blueprint(bp)
+    return app
+
+
+# The entrypoint for gunicorn main:app and flask --app main; tests build their own.
+app = create_app()
+
+
+def precarica() -> None:
+    """Load what every worker needs once, before gunicorn forks them.
+
+    Called in the master when preload_app is on: the client libraries, the
+    tokenizer tables and the glossary then live in pages shared copy-on-write
+    by all workers instead of being loaded again by each of them. Nothing here
+    opens sockets, SQLite connections or threads, which must not cross a fork.
+    """
+    import deep_translator, openai  # noqa: E401, F401
+    encoder()
+    _carica_glossario()
+
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
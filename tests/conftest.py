@@ -0,0 +1,36 @@
+import os
+import re
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="sententia-test-"))
+
+import main  # noqa: E402
+
+
+class EncoderFinto:
+    """One token per word and one per newline, so counts are easy to reason about offline."""
+
+    def encode_ordinary(self, testo):
+        return re.findall(r"\n|[^\s]+", testo)
+
+    def encode_ordinary_batch(self, testi):
+        return [self.encode_ordinary(t) for t in testi]
+
+    def decode(self, tokens):
+        testo = ""
+        for i, tok in enumerate(tokens):
+            testo += tok if i == 0 or tok == "\n" or tokens[i - 1] == "\n" else " " + tok
+        return testo
+
+
+@pytest.fixture
+def encoder_finto(monkeypatch):
+    """Replace the tiktoken encoder (its tables need network access) and start from an empty memo."""
+    monkeypatch.setattr(main, "_encoder", EncoderFinto())
+    main._token_memo.clear()
+    yield main._encoder
+    main._token_memo.clear()
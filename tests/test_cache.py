@@ -0,0 +1,24 @@
+import uuid
+
+import main
+
+
+def test_diskcache_lru_e_ttl():
+    cache = main.BlobCache(f"cache_{uuid.uuid4().hex}", 250)
+    for k in "abc":
+        cache.set(k, k.encode() * 100)
+    assert cache.get("a") is None  # 300 bytes do not fit: the oldest goes
+    assert cache.get("b") == b"b" * 100  # read recently: survives the next eviction
+    cache.set("d", b"d" * 100)
+    assert cache.get("c") is None
+    assert cache.get("b") is not None and cache.get("d") is not None
+
+    cache.ttl = -1
+    assert cache.get("d") is None
+
+
+def test_diskcache_valore_troppo_grande():
+    cache = main.DiskCache(f"cache_{uuid.uuid4().hex}", 50)
+    cache.set("piccolo", "x")
+    cache.set("grande", "".join(str(i) for i in range(1000)))
+    assert cache.get("piccolo") is None and cache.get("grande") is None
@@ -0,0 +1,79 @@
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+import main
+
+
+class RispostaFinta:
+    def __init__(self, stato, headers=None):
+        self.status_code = stato
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Script the upstream: each item is a status code, a (status, headers) pair or an exception."""
+    copione, chiamate, attese = [], [], []
+
+    def invia(method, url, timeout, sem, kwargs):
+        chiamate.append(method)
+        passo = copione.pop(0)
+        if isinstance(passo, Exception):
+            raise passo
+        return RispostaFinta(*passo) if isinstance(passo, tuple) else RispostaFinta(passo)
+
+    monkeypatch.setattr(main, "_invia", invia)
+    monkeypatch.setattr(main.time, "sleep", attese.append)
+    monkeypatch.setattr(main, "HTTP_RETRIES", 2)
+    return copione, chiamate, attese
+
+
+def test_get_ritentato_con_retry_after_limitato(upstream):
+    copione, chiamate, attese = upstream
+    copione += [(503, {"Retry-After": "3600"}), 429, 200]
+    assert main.http_get("https://esempio.test/a").status_code == 200
+    assert len(chiamate) == 3
+    assert attese == [main.HTTP_RETRY_AFTER_MAX, 1.0]
+
+
+def test_post_non_ritentato(upstream):
+    copione, chiamate, _ = upstream
+    copione += [503, 200]
+    assert main.http_post("https://esempio.test/a").status_code == 503
+    assert len(chiamate) == 1
+
+
+def test_post_idempotente_ritentato(upstream):
+    copione, chiamate, _ = upstream
+    copione += [requests.ConnectionError(), 502, 200]
+    assert main.http_post("https://esempio.test/a", idempotente=True).status_code == 200
+    assert len(chiamate) == 3
+
+
+def test_timeout_di_lettura(upstream):
+    copione, chiamate, _ = upstream
+    copione += [requests.ReadTimeout(), requests.ReadTimeout()]
+    with pytest.raises(requests.ReadTimeout):
+        main.http_get("https://esempio.test/a", timeout=main.HTTP_RETRY_READ_MAX + 1)
+    assert len(chiamate) == 1
+    copione[:] = [requests.ReadTimeout(), 200]
+    assert main.http_get("https://esempio.test/a", timeout=5).status_code == 200
+
+
+def test_tentativi_esauriti(upstream):
+    copione, chiamate, _ = upstream
+    copione += [500, 500, 500, 200]
+    assert main.http_get("https://esempio.test/a").status_code == 500
+    assert len(chiamate) == 3
+
+
+def test_retry_after_data_http():
+    risposta = RispostaFinta(503, {"Retry-After": formatdate(time.time() + 4, usegmt=True)})
+    assert 2.5 < main._attesa_retry(0, risposta) <= 4
+    assert main._attesa_retry(3, RispostaFinta(503, {"Retry-After": "domani"})) == 4.0
@@ -0,0 +1,61 @@
+import uuid
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def indice():
+    return main.IndiceSentenze(f"indice_{uuid.uuid4().hex}", 10_000)
+
+
+def _codici(risultati):
+    return [s["codice"] for s in risultati]
+
+
+def test_aggiornamento_incrementale(indice):
+    indice.aggiungi("4a 1/2020", "l1", "diritto di locazione disdetta")
+    assert _codici(indice.cerca(["disdetta"], 5)) == ["4A_1/2020"]
+    indice.aggiungi("4A_1/2020", sintesi="risarcimento del danno")
+    assert _codici(indice.cerca(["risarcimento"], 5)) == ["4A_1/2020"]
+    assert _codici(indice.cerca(["disdetta"], 5)) == ["4A_1/2020"]  # text kept, link too
+    assert indice.cerca(["disdetta"], 5)[0]["link"] == "l1"
+    indice.aggiungi("4A_1/2020", testo="contratto di appalto")
+    assert indice.cerca(["disdetta"], 5) == []
+    assert _codici(indice.cerca(["appalto"], 5)) == ["4A_1/2020"]
+    (n,) = indice._conn().execute("SELECT COUNT(*) FROM documenti").fetchone()
+    assert n == 1
+
+
+def test_limite_lru(indice):
+    indice.max_bytes = 3100  # three texts fit, the fourth evicts one
+    for i in range(3):
+        indice.aggiungi(f"1C_{i}/2020", testo=f"parola{i} " + "x" * 1000)
+    indice.cerca(["parola0"], 5)  # found recently: survives the next eviction
+    indice.aggiungi("1C_3/2020", testo="parola3 " + "x" * 1000)
+    assert _codici(indice.cerca(["parola0"], 5)) == ["1C_0/2020"]
+    assert indice.cerca(["parola1"], 5) == []
+    assert _codici(indice.cerca(["parola3"], 5)) == ["1C_3/2020"]
+    (totale,) = indice._conn().execute("SELECT SUM(size) FROM documenti").fetchone()
+    assert totale <= indice.max_bytes
+
+
+def test_soglia_punteggio(indice):
+    indice.aggiungi("2C_1/2021", testo="imposta " * 5 + "altro " * 50)
+    assert indice.cerca(["imposta"], 5)
+    indice.punteggio_min = 1e6
+    assert indice.cerca(["imposta"], 5) == []
+
+
+def test_indice_pieno_non_interroga_cse(indice, monkeypatch):
+    for i in range(3):
+        indice.aggiungi(f"5A_{i}/2022", testo="eredità legittima")
+    chiamate = []
+    monkeypatch.setattr(main, "_indice", indice)
+    monkeypatch.setattr(main, "traduci", lambda testo, lingua: testo)
+    monkeypatch.setattr(main, "_cse_query", lambda query: chiamate.append(query) or [])
+    assert len(main.cerca_sentenze_google("eredità legittima", 3)) == 3
+    assert chiamate == []
+    assert len(main.cerca_sentenze_google("eredità legittima", 4)) == 3
+    assert len(chiamate) == len(main.LINGUE_RICERCA)
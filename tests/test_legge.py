@@ -0,0 +1,122 @@
+import gzip
+import json
+import re
+import uuid
+
+import brotli
+import pytest
+
+import main
+
+ELEMENTI = [
+    {"type": "h1", "id": "", "text": "Titolo primo"},
+    {"type": "article", "id": "art_1", "text": "Art. 1"},
+    {"type": "article", "id": "art_2", "text": "Art. 2"},
+    {"type": "h1", "id": "", "text": "Titolo secondo"},
+    {"type": "article", "id": "art_3", "text": "Art. 3"},
+]
+VOCE = {"articoli": ELEMENTI, "indice": main._indicizza_legge(ELEMENTI)}
+
+
+@pytest.mark.parametrize("args, stato", [
+    ({"art": "99"}, 404),
+    ({"da": "1", "a": "99"}, 404),
+    ({"da": "3", "a": "1"}, 400),
+    ({"sezione": "-1"}, 400),
+    ({"sezione": "2"}, 400),
+    ({"sezione": "uno"}, 400),
+    ({"pagina": "0"}, 400),
+    ({"pagina": "-3"}, 400),
+    ({"per_pagina": "1.5"}, 400),
+])
+def test_seleziona_legge_errori(args, stato):
+    selezione, errore, codice = main._seleziona_legge(VOCE, args)
+    assert selezione is None and errore and codice == stato
+
+
+def test_seleziona_legge_sezione_e_pagina():
+    selezione, errore, stato = main._seleziona_legge(VOCE, {"sezione": "1"})
+    assert errore is None and stato == 200
+    assert [el["id"] for el in selezione["articoli"]] == ["", "art_3"]
+    selezione, _, _ = main._seleziona_legge(VOCE, {"pagina": "2", "per_pagina": "2"})
+    assert selezione["articoli"] == ELEMENTI[2:4] and selezione["pagine"] == 3
+
+
+def _precompressa(voce, **headers):
+    with main.app.test_request_context("/legge", headers=headers):
+        return main._risposta_precompressa("210|it", voce)
+
+
+def _voce():
+    """A cached law entry whose payload, and so its ETag, no other test shares."""
+    return {**VOCE, "titolo": uuid.uuid4().hex, "html_url": "https://fedlex.test/210.html",
+            "versione": uuid.uuid4().hex, "verificato": 0}
+
+
+def test_legge_precompressa_negoziazione():
+    voce = _voce()
+    risposta = _precompressa(voce)
+    etag, _ = risposta.get_etag()
+    corpo = risposta.get_data()
+    assert json.loads(corpo)["articoli"] == ELEMENTI
+    assert "Content-Encoding" not in risposta.headers and risposta.headers["Vary"] == "Accept-Encoding"
+
+    main._compressione_brotli.submit(lambda: None).result()  # brotli variant written
+    risposta = _precompressa(voce, **{"Accept-Encoding": "gzip, br"})
+    assert risposta.headers["Content-Encoding"] == "br" and risposta.get_etag()[0] == f"{etag}-br"
+    assert brotli.decompress(risposta.get_data()) == corpo
+
+    risposta = _precompressa(voce, **{"Accept-Encoding": "gzip"})
+    assert risposta.headers["Content-Encoding"] == "gzip" and risposta.get_etag()[0] == f"{etag}-gzip"
+    assert gzip.decompress(risposta.get_data()) == corpo
+
+    # Any variant's tag revalidates: the content behind all of them is the same.
+    risposta = _precompressa(voce, **{"Accept-Encoding": "br", "If-None-Match": f'"{etag}-gzip"'})
+    assert risposta.status_code == 304 and not risposta.get_data()
+    # A new version with the same content keeps its ETag.
+    assert _precompressa({**voce, "versione": "2"}, **{"If-None-Match": f'"{etag}"'}).status_code == 304
+    assert _precompressa(_voce(), **{"If-None-Match": f'"{etag}"'}).status_code == 200
+
+
+def test_legge_precompressa_brotli_non_pronto(monkeypatch):
+    monkeypatch.setattr(main, "_comprimi_brotli", lambda etag, corpo: None)
+    risposta = _precompressa(_voce(), **{"Accept-Encoding": "br, gzip"})
+    assert risposta.headers["Content-Encoding"] == "gzip"
+
+
+class SparqlFinto:
+    """Answer each VALUES pair whose sr is not "0" with a filestore URL; record the queried pairs."""
+
+    def __init__(self):
+        self.batch = []
+
+    def __call__(self, url, data, **kwargs):
+        coppie = re.findall(r'\("([^"]+)" "([^"]+)"\)', data["query"])
+        self.batch.append(coppie)
+        risposta = type("Risposta", (), {})()
+        risposta.raise_for_status = lambda: None
+        risposta.json = lambda: {"results": {"bindings": [
+            {"sr": {"value": sr}, "lang": {"value": lang},
+             "best": {"value": f"eli/x|{main.PRIVATE_FILESTORE}{sr}-{lang}.html"}}
+            for sr, lang in coppie if sr != "0"
+        ]}}
+        return risposta
+
+
+def test_sparql_valori_a_lotti(monkeypatch):
+    sparql = SparqlFinto()
+    monkeypatch.setattr(main, "http_post", sparql)
+    monkeypatch.setattr(main, "_sparql_cache", main.DiskCache(f"sparql_{uuid.uuid4().hex}", 1 << 20))
+    coppie = [(str(sr), "it") for sr in range(main.SPARQL_BATCH + 5)]
+    risultati = main._sparql_html_urls(coppie + [("210", "it"), ("2 10", "it"), ("210", "ita")])
+
+    assert [len(b) for b in sparql.batch] == [main.SPARQL_BATCH, 6]
+    assert risultati[("0", "it")] is None
+    assert risultati[("210", "it")] == f"{main.PUBLIC_FILESTORE}210-it.html"
+    assert ("2 10", "it") not in risultati and ("210", "ita") not in risultati
+
+    sparql.batch.clear()
+    assert main._sparql_html_url("210", "it") == f"{main.PUBLIC_FILESTORE}210-it.html"
+    assert sparql.batch == []  # served from the resolution cache
+    main._sparql_html_url("210", "it", fresco=True)
+    assert sparql.batch == [[("210", "it")]]
@@ -0,0 +1,32 @@
+import os
+import uuid
+
+import main
+
+
+def _valore(testo, riga):
+    for linea in testo.splitlines():
+        if linea.startswith(riga + " "):
+            return float(linea.rsplit(" ", 1)[1])
+    return None
+
+
+def test_accorpa_processi_terminati():
+    metriche = main.Metriche(f"metriche_{uuid.uuid4().hex}")
+    conn = metriche._conn()
+    voce = ("sententia_cache_totale", 'cache="x",esito="hit"')
+    # Two exited workers (the second one's pid was reused by this process) and the aggregate.
+    conn.executemany(
+        "INSERT INTO contatori (pid, avvio, nome, etichette, valore) VALUES (?, ?, ?, ?, ?)",
+        [(0, 0, *voce, 1), (2 ** 22 + 1, 5.0, *voce, 2), (os.getpid(), -1.0, *voce, 3)],
+    )
+    metriche.incrementa("sententia_cache_totale", 4, cache="x", esito="hit")
+
+    riga = 'sententia_cache_totale{cache="x",esito="hit"}'
+    assert _valore(metriche.esporta(), riga) == 10
+    assert conn.execute("SELECT pid, valore FROM contatori ORDER BY pid").fetchall() == [
+        (0, 6), (os.getpid(), 4),
+    ]
+    # Flushing again replaces this process's cumulative value instead of adding to it.
+    metriche.incrementa("sententia_cache_totale", cache="x", esito="hit")
+    assert _valore(metriche.esporta(), riga) == 11
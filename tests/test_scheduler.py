@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(main, "LLM_RPM", 2)
+    monkeypatch.setattr(main, "LLM_TPM", 100)
+    monkeypatch.setattr(main, "LLM_ATTESA_MAX", 0.5)
+    return main.SchedulerLLM(f"scheduler_{uuid.uuid4().hex}")
+
+
+def test_rpm_esaurito(scheduler):
+    assert scheduler.acquisisci(10, main.PRIORITA_INTERATTIVA) is not None
+    assert scheduler.acquisisci(10, main.PRIORITA_INTERATTIVA) is not None
+    with pytest.raises(main.BudgetLLMEsaurito):
+        scheduler.acquisisci(10, main.PRIORITA_INTERATTIVA)
+    assert scheduler.consumo() == (2, 20)
+
+
+def test_tpm_e_correzione(scheduler):
+    id_ = scheduler.acquisisci(60, main.PRIORITA_INTERATTIVA)
+    with pytest.raises(main.BudgetLLMEsaurito):
+        scheduler.acquisisci(60, main.PRIORITA_INTERATTIVA)
+    scheduler.correggi(id_, 10)  # the call used far less than booked
+    assert scheduler.acquisisci(60, main.PRIORITA_INTERATTIVA) is not None
+    assert scheduler.consumo() == (2, 70)
+
+
+def test_chiamata_oltre_il_budget_passa_da_sola(scheduler):
+    assert scheduler.acquisisci(500, main.PRIORITA_BATCH) is not None
+    with pytest.raises(main.BudgetLLMEsaurito):
+        scheduler.acquisisci(1, main.PRIORITA_BATCH)
+
+
+def test_priorita_sorpassa_la_coda(scheduler, monkeypatch):
+    monkeypatch.setattr(main, "LLM_RPM", 1)
+    monkeypatch.setattr(main, "LLM_ATTESA_MAX", 5)
+    scheduler.FINESTRA = 0.4
+    scheduler.acquisisci(1, main.PRIORITA_INTERATTIVA)
+
+    ordine = []
+
+    def chiama(priorita):
+        scheduler.acquisisci(1, priorita)
+        ordine.append(priorita)
+
+    batch = threading.Thread(target=chiama, args=(main.PRIORITA_BATCH,))
+    batch.start()
+    while not scheduler._attesa:
+        time.sleep(0.01)
+    interattiva = threading.Thread(target=chiama, args=(main.PRIORITA_INTERATTIVA,))
+    interattiva.start()
+    batch.join()
+    interattiva.join()
+    assert ordine == [main.PRIORITA_INTERATTIVA, main.PRIORITA_BATCH]
+    assert scheduler._attesa == []
+
+
+def test_precedenza_di_un_altro_worker(scheduler):
+    scheduler._conn().execute(
+        "INSERT INTO code (pid, priorita, in_coda, aggiornato) VALUES (?, ?, 1, ?)",
+        (os.getpid() + 1, main.PRIORITA_INTERATTIVA, time.time()),
+    )
+    with pytest.raises(main.BudgetLLMEsaurito):
+        scheduler.acquisisci(1, main.PRIORITA_BATCH)
+    assert scheduler.acquisisci(1, main.PRIORITA_INTERATTIVA) is not None
+    assert scheduler.profondita() == {
+        main.PRIORITA_INTERATTIVA: 1, main.PRIORITA_BATCH: 0, main.PRIORITA_FONDO: 0,
+    }
@@ -0,0 +1,131 @@
+import main
+
+SENTENZA_FR = """\
+Tribunal fédéral
+4A_123/2020
+Arrêt du 3 mars 2021
+Ire Cour de droit civil
+Composition
+Mmes et M. les Juges fédéraux Hohl, présidente, Kiss et Rüedi.
+Participants à la procédure
+A.________, recourant,
+contre
+B.________ SA, intimée.
+Objet
+contrat de bail; résiliation,
+recours contre l'arrêt rendu le 5 mai 2020 par la Chambre d'appel des baux et loyers.
+Faits :
+A.
+Le 1er janvier 2015, B.________ SA a remis à bail un appartement au recourant.
+B.
+La bailleresse a résilié le bail pour le 31 mars 2019.
+Considérant en droit :
+1.
+La cour cantonale a exposé les faits sous le titre
+Faits
+sans que ce rappel ouvre une nouvelle section.
+2.
+Le congé n'est pas contraire à la bonne foi (art. 271 CO).
+Par ces motifs, le Tribunal fédéral prononce :
+1.
+Le recours est rejeté.
+2.
+Les frais judiciaires, arrêtés à 5000 fr., sont mis à la charge du recourant.
+3.
+Le recourant versera à l'intimée une indemnité de 6000 fr. à titre de dépens.
+4.
+Le présent arrêt est communiqué aux parties et à la Chambre d'appel.
+Lausanne, le 3 mars 2021
+Au nom de la Ire Cour de droit civil
+du Tribunal fédéral suisse
+"""
+
+SENTENZA_IT = """\
+Tribunale federale
+5A_456/2021
+Sentenza del 10 giugno 2022
+II Corte di diritto civile
+Composizione
+Giudici federali Herrmann, Presidente, von Werdt e Bovey.
+Partecipanti al procedimento
+A.________, ricorrente,
+contro
+B.________, opponente.
+Oggetto
+divorzio (contributo di mantenimento),
+ricorso contro la sentenza emanata il 3 marzo 2021 dalla I Camera civile del Tribunale d'appello.
+Fatti:
+A.
+I coniugi si sono sposati nel 2005.
+B.
+Il Pretore ha pronunciato il divorzio.
+Diritto:
+1.
+Il ricorso è tempestivo (art. 100 cpv. 1 LTF).
+2.
+Il contributo di mantenimento è stato calcolato correttamente.
+Per questi motivi, il Tribunale federale pronuncia:
+1.
+Il ricorso è respinto.
+2.
+Le spese giudiziarie di fr. 3'000.-- sono poste a carico del ricorrente.
+3.
+Comunicazione alle parti e alla I Camera civile del Tribunale d'appello.
+Losanna, 10 giugno 2022
+In nome della II Corte di diritto civile
+del Tribunale federale svizzero
+"""
+
+
+def test_sezioni_sentenza_francese():
+    sezioni = main.sezioni_sentenza(SENTENZA_FR)
+    assert list(sezioni) == ["intestazione", "oggetto", "fatti", "considerandi", "dispositivo", "firma"]
+    assert sezioni["oggetto"].startswith("Objet\ncontrat de bail")
+    assert sezioni["fatti"].startswith("Faits :")
+    # A heading quoted inside the considerations does not reopen "fatti".
+    assert "sans que ce rappel" in sezioni["considerandi"]
+    assert sezioni["dispositivo"].startswith("Par ces motifs")
+    assert sezioni["firma"].startswith("Lausanne, le 3 mars 2021")
+
+
+def test_sezioni_sentenza_italiana():
+    sezioni = main.sezioni_sentenza(SENTENZA_IT)
+    assert list(sezioni) == ["intestazione", "oggetto", "fatti", "considerandi", "dispositivo", "firma"]
+    assert sezioni["oggetto"].startswith("Oggetto\ndivorzio")
+    assert sezioni["fatti"].startswith("Fatti:")
+    assert sezioni["considerandi"].startswith("Diritto:")
+    assert sezioni["dispositivo"].startswith("Per questi motivi")
+    assert sezioni["firma"].startswith("Losanna, 10 giugno 2022")
+
+
+def test_dispositivo_essenziale_francese():
+    dispositivo = main.sezioni_sentenza(SENTENZA_FR)["dispositivo"]
+    assert main.dispositivo_essenziale(dispositivo) == (
+        "Par ces motifs, le Tribunal fédéral prononce :\n1.\nLe recours est rejeté.")
+
+
+def test_dispositivo_essenziale_italiano():
+    dispositivo = main.sezioni_sentenza(SENTENZA_IT)["dispositivo"]
+    assert main.dispositivo_essenziale(dispositivo) == (
+        "Per questi motivi, il Tribunale federale pronuncia:\n1.\nIl ricorso è respinto.")
+
+
+def test_dispositivo_essenziale_tiene_i_punti_di_merito():
+    dispositivo = ("Per questi motivi, il Tribunale federale pronuncia:\n"
+                   "1.\nIl ricorso è parzialmente accolto.\n"
+                   "2.\nLa causa è rinviata all'autorità inferiore per nuovo giudizio.\n"
+                   "3.\nLe spese giudiziarie di fr. 2'000.-- sono poste a carico delle parti.\n"
+                   "4.\nComunicazione alle parti.")
+    essenziale = main.dispositivo_essenziale(dispositivo)
+    assert "rinviata" in essenziale
+    assert "spese" not in essenziale and "Comunicazione" not in essenziale
+
+
+def test_contenuto_sentenza():
+    html = ('<html><body><div id="menu">Menu</div><div id="content"><p>Fatti:</p>'
+            '<script>var x = 1;</script><p>A. Il <b>ricorrente</b></p></div>coda</body></html>')
+    assert main.etree.tostring(main.contenuto_sentenza(html), encoding="unicode", method="html",
+                               with_tail=False).startswith('<div id="content"><p>Fatti:</p>')
+    assert main.testo_contenuto_sentenza(html) == "Fatti:\nA. Il \nricorrente"
+    assert main.contenuto_sentenza("<html><body>niente</body></html>") is None
+    assert main.testo_contenuto_sentenza("") == ""
@@ -0,0 +1,42 @@
+import pytest
+
+import main
+
+# Lines of 3, 2 and 4 tokens: with the two newlines the whole text is 11 tokens.
+TESTO = "a b c\nd e\nf g h i"
+
+
+@pytest.mark.parametrize("max_tokens, atteso", [
+    (11, TESTO),
+    (10, "a b c\nd e\nf g h"),
+    (7, "a b c\nd e"),   # the next newline fits, but no token of the last line
+    (6, "a b c\nd e"),   # exactly the first two lines
+    (5, "a b c\nd"),
+    (4, "a b c"),        # the newline after the first line fits, nothing else
+    (3, "a b c"),
+    (2, "a b"),
+])
+def test_tronca_token_memo_al_limite(encoder_finto, max_tokens, atteso):
+    main.token_per_riga(TESTO)
+    assert main.tronca_token(TESTO, max_tokens) == atteso
+
+
+@pytest.mark.parametrize("memo", [False, True], ids=["prefisso", "memo"])
+def test_tronca_token_non_supera_il_limite(encoder_finto, memo):
+    testo = "\n".join(" ".join(["x"] * n) for n in (3, 1, 5, 0, 2, 4))
+    if memo:
+        main.token_per_riga(testo)
+    for max_tokens in range(1, 25):
+        troncato = main.tronca_token(testo, max_tokens)
+        assert testo.startswith(troncato)
+        assert len(encoder_finto.encode_ordinary(troncato)) <= max_tokens
+
+
+@pytest.mark.parametrize("memo", [False, True], ids=["prefisso", "memo"])
+def test_tronca_token_contati(encoder_finto, memo):
+    testo = "\n".join(" ".join(["x"] * n) for n in (3, 1, 5, 0, 2, 4))
+    if memo:
+        main.token_per_riga(testo)
+    for max_tokens in range(1, 25):
+        troncato, n = main.tronca_token_contati(testo, max_tokens)
+        assert n == len(encoder_finto.encode_ordinary(troncato)) <= max_tokens